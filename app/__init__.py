@@ -1,17 +1,69 @@
-from flask import Flask
-from flask_bs4 import Bootstrap
+import os
+
+from flask import Config, Flask
 from flask_login import LoginManager
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 
-from config import Config
+from app.replica import RoutingSQLAlchemy
+from config import get_config
+
+db = RoutingSQLAlchemy()
+migrate = Migrate()
+login = LoginManager()
+login.login_view = "main.login"
+
+_settings = None
+
+
+def get_settings():
+    """Return the config of the app create_app built last, or of the
+    FLASK_CONFIG profile until one is built.
+
+    Celery tasks, the thread pools they start and the clients shared by a
+    process run outside an app context, so they read their settings here
+    rather than from current_app.
+    """
+    global _settings
+    if _settings is None:
+        _settings = Config(os.path.dirname(__file__))
+        _settings.from_object(get_config())
+    return _settings
+
+
+def create_app(config_class=None, web=True):
+    """Build the Flask app, with the config profile named by FLASK_CONFIG
+    unless config_class is given.
+
+    Celery workers pass web=False and get the database but none of the
+    routes, templates or request hooks.
+    """
+    global _settings
+    config_class = config_class or get_config()
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+    config_class.init_app(app)
+    _settings = app.config
+    db.init_app(app)
+    migrate.init_app(app, db)
+    login.init_app(app)
+
+    from app import cli, tasks
+
+    cli.init_app(app)
+    tasks.init_app(app)
+
+    if web:
+        from flask_bs4 import Bootstrap
+
+        from app import metrics, profiling
+        from app.routes import bp
+
+        Bootstrap(app)
+        app.register_blueprint(bp)
+        metrics.init_app(app)
+        profiling.init_app(app)
+
+    return app
 
-app = Flask(__name__)
-Bootstrap(app)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-login = LoginManager(app)
-login.login_view = "login"
 
-from app import routes
+from app import models
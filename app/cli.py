@@ -0,0 +1,102 @@
+import click
+from sqlalchemy import Integer, and_, bindparam, create_engine, func, select, text
+
+from app import db
+
+
+def schema_version(engine):
+    try:
+        return engine.execute(text("SELECT version_num FROM alembic_version")).scalar()
+    except Exception:
+        return None
+
+
+def copy_table(source, target, table, batch_size):
+    # rows pointing at rows of the same table may come before them, so
+    # those columns are filled in once every row is there
+    self_refs = [fk.parent for fk in table.foreign_keys if fk.column.table is table]
+    primary_key = list(table.primary_key.columns)
+    deferred = []
+    copied = 0
+    result = source.execute(table.select())
+    while True:
+        rows = [dict(row) for row in result.fetchmany(batch_size)]
+        if not rows:
+            break
+        for row in rows:
+            refs = {c.key: row[c.key] for c in self_refs if row[c.key] is not None}
+            if refs:
+                update = {"_pk_" + c.key: row[c.key] for c in primary_key}
+                update.update(("_ref_" + key, value) for key, value in refs.items())
+                deferred.append(update)
+                row.update((key, None) for key in refs)
+        target.execute(table.insert(), rows)
+        copied += len(rows)
+    for column in self_refs:
+        updates = [u for u in deferred if "_ref_" + column.key in u]
+        if updates:
+            target.execute(
+                table.update()
+                .where(
+                    and_(*[c == bindparam("_pk_" + c.key) for c in primary_key])
+                )
+                .values({column.key: bindparam("_ref_" + column.key)}),
+                updates,
+            )
+    return copied
+
+
+def reset_sequences(connection, table):
+    # Postgres hands out serial ids from a sequence, which copying rows
+    # with their ids doesn't advance
+    preparer = connection.dialect.identifier_preparer
+    for column in table.primary_key.columns:
+        if not isinstance(column.type, Integer):
+            continue
+        connection.execute(
+            text(
+                "SELECT setval(pg_get_serial_sequence(:table, :column), "
+                "COALESCE(MAX({}), 0) + 1, false) FROM {}".format(
+                    preparer.quote(column.name), preparer.format_table(table)
+                )
+            ),
+            table=preparer.format_table(table),
+            column=column.name,
+        )
+
+
+def init_app(app):
+    @app.cli.command("copy-db")
+    @click.argument("source_url")
+    @click.option("--batch-size", default=500, show_default=True)
+    def copy_db(source_url, batch_size):
+        """Copy every row from SOURCE_URL into the app's database.
+
+        Used to move off SQLite: create the new database with "flask db
+        upgrade" against DATABASE_URL, then run, for example,
+
+            flask copy-db sqlite:///app.db
+
+        Both databases must be at the same migration and the new one must
+        be empty. Everything is copied in one transaction.
+        """
+        source = create_engine(source_url)
+        versions = schema_version(source), schema_version(db.engine)
+        if versions[0] != versions[1]:
+            raise click.ClickException(
+                "Upgrade both databases to the same migration first "
+                "({} and {})".format(*versions)
+            )
+        with source.connect() as reader, db.engine.begin() as writer:
+            tables = db.metadata.sorted_tables
+            for table in tables:
+                if writer.execute(select([func.count()]).select_from(table)).scalar():
+                    raise click.ClickException(
+                        "Table {} is not empty".format(table.name)
+                    )
+            for table in tables:
+                copied = copy_table(reader, writer, table, batch_size)
+                click.echo("{}: {} rows".format(table.name, copied))
+            if writer.dialect.name == "postgresql":
+                for table in tables:
+                    reset_sequences(writer, table)
@@ -0,0 +1,139 @@
+import json
+import os
+import tempfile
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app import get_settings
+
+
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/{api}/{version}/rest"
+
+# Clients are built once per process and reused, so connections stay open
+# and tokens stay cached between tasks and requests. Celery forks its
+# workers after importing this module, so everything here is also keyed
+# on the process id. The Google and Spotify libraries are slow to import,
+# so they are only imported once a client is first needed.
+_lock = threading.Lock()
+_spotify = {}
+_discovery = {}
+_local = threading.local()
+
+
+def get_spotify_client():
+    """Return this process's Spotify client.
+
+    The client credentials token is cached by spotipy until it expires, and
+    the connection pool is sized for concurrent page fetches.
+    """
+    import MySpotify
+
+    pid = os.getpid()
+    with _lock:
+        if pid not in _spotify:
+            client = MySpotify.get_spotify_client()
+            session = getattr(client, "_session", None)
+            if isinstance(session, requests.Session):
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=get_settings()["SPOTIFY_FETCH_WORKERS"],
+                )
+                session.mount("https://", adapter)
+            _spotify.clear()
+            _spotify[pid] = client
+        return _spotify[pid]
+
+
+def _discovery_path(api, version):
+    return os.path.join(
+        get_settings()["DISCOVERY_CACHE_DIR"],
+        "{}_{}_discovery.json".format(api, version),
+    )
+
+
+def _fetch_discovery_document(api, version):
+    # newer google-api-python-client releases ship the documents
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+    except ImportError:
+        get_static_doc = None
+    if get_static_doc is not None:
+        document = get_static_doc(api, version)
+        if document:
+            return document
+    response = requests.get(
+        DISCOVERY_URL.format(api=api, version=version), timeout=30
+    )
+    response.raise_for_status()
+    return response.text
+
+
+def _write_file(path, text):
+    # other processes may read the file while it's being written, so it
+    # only appears under its name once it's complete
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def get_discovery_document(api=None, version=None):
+    # parsed once per process, downloaded once per machine
+    settings = get_settings()
+    api = api or settings["YOUTUBE_API_SERVICE_NAME"]
+    version = version or settings["YOUTUBE_API_VERSION"]
+    with _lock:
+        if (api, version) not in _discovery:
+            path = _discovery_path(api, version)
+            if not os.path.exists(path):
+                _write_file(path, _fetch_discovery_document(api, version))
+            with open(path) as f:
+                _discovery[(api, version)] = json.load(f)
+        return _discovery[(api, version)]
+
+
+def _thread_http():
+    # httplib2 isn't thread safe, so each thread keeps its own connections
+    import httplib2
+
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.http = httplib2.Http(
+            timeout=get_settings()["GOOGLE_HTTP_TIMEOUT"]
+        )
+        _local.key_client = None
+    return _local.http
+
+
+def youtube_client(credentials):
+    """Return a YouTube client acting as the user with the given
+    google.oauth2 credentials, on this thread's connections."""
+    import google_auth_httplib2
+    import googleapiclient.discovery
+
+    http = google_auth_httplib2.AuthorizedHttp(credentials, http=_thread_http())
+    return googleapiclient.discovery.build_from_document(
+        get_discovery_document(), http=http
+    )
+
+
+def youtube_key_client():
+    # API key client for public data such as searches, one per thread
+    import googleapiclient.discovery
+
+    _thread_http()
+    if _local.key_client is None:
+        _local.key_client = googleapiclient.discovery.build_from_document(
+            get_discovery_document(),
+            developerKey=get_settings()["YOUTUBE_API_KEY"],
+            http=_local.http,
+        )
+    return _local.key_client
@@ -0,0 +1,99 @@
+import json
+import zlib
+
+from kombu.serialization import register
+from kombu.utils.json import dumps as kombu_dumps
+from kombu.utils.json import loads as kombu_loads
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+
+# first bytes of every encoded result, anything else is legacy JSON text
+MAGIC = b"SYT1"
+
+
+def pack_tracks(rows):
+    """Turn [name, artists, length, spotify_id] rows into columns.
+
+    Each distinct artists string is stored once, rows refer to it by
+    index. The packed form is plain JSON, so it can be returned from a
+    task as is.
+    """
+    artists = {}
+    packed = {"names": [], "artists": [], "artist_idx": [], "lengths": []}
+    ids = []
+    for row in rows:
+        packed["names"].append(row[0])
+        index = artists.get(row[1])
+        if index is None:
+            index = artists[row[1]] = len(packed["artists"])
+            packed["artists"].append(row[1])
+        packed["artist_idx"].append(index)
+        packed["lengths"].append(row[2])
+        ids.append(row[3] if len(row) > 3 else None)
+    if any(ids):
+        packed["ids"] = ids
+    return packed
+
+
+def unpack_tracks(packed):
+    names = packed["names"]
+    artists = [packed["artists"][i] for i in packed["artist_idx"]]
+    if "ids" in packed:
+        columns = (names, artists, packed["lengths"], packed["ids"])
+    else:
+        columns = (names, artists, packed["lengths"])
+    return [list(row) for row in zip(*columns)]
+
+
+def encode_tracks(rows):
+    text = json.dumps(pack_tracks(rows), separators=(",", ":"))
+    return MAGIC + zlib.compress(text.encode("utf-8"))
+
+
+def decode_tracks(data):
+    # Postgres hands back JSON columns already parsed
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        return unpack_tracks(data)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    data = bytes(data)
+    if data.startswith(MAGIC):
+        return unpack_tracks(json.loads(zlib.decompress(data[len(MAGIC):])))
+    # stored before results were compacted
+    return json.loads(data)
+
+
+class CompactTracks(TypeDecorator):
+    """Track rows stored as compressed columns, see encode_tracks."""
+
+    impl = LargeBinary
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode_tracks(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decode_tracks(value)
+
+
+def compact_dumps(obj):
+    return zlib.compress(kombu_dumps(obj).encode("utf-8"))
+
+
+def compact_loads(data):
+    return kombu_loads(zlib.decompress(data).decode("utf-8"))
+
+
+# zlib compressed JSON, used for task results in the Celery backend
+register(
+    "compact",
+    compact_dumps,
+    compact_loads,
+    content_type="application/x-compact-json",
+    content_encoding="binary",
+)
@@ -0,0 +1,219 @@
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+
+from app import get_settings
+from app.clients import youtube_key_client
+from app.redis_conn import get_redis
+from app.youtube import is_quota_error, quota_day
+
+
+# YouTube Data API quota cost of each call
+SEARCH_COST = 100
+VIDEOS_LIST_COST = 1
+
+_DURATION_RE = re.compile(
+    r"P(?:(?P<days>\d+)D)?"
+    r"(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?"
+)
+_NOISE_RE = re.compile(
+    r"[\(\[][^\)\]]*(official|video|audio|lyric|hd|hq|4k)[^\)\]]*[\)\]]"
+)
+
+
+class QuotaExhausted(Exception):
+    pass
+
+
+class QuotaLimiter(object):
+    """Spends YouTube API quota for every worker through one Redis counter.
+
+    The daily budget resets with the API's own quota day, at midnight
+    Pacific time. Searches are also spaced at most per_second apart in this
+    process, so a burst of tracks doesn't trip the per-minute limits.
+    """
+
+    def __init__(self, daily_quota, per_second, redis_client=None):
+        self.daily_quota = daily_quota
+        self.interval = 1.0 / per_second
+        self.redis = redis_client or get_redis()
+        self.lock = threading.Lock()
+        self.next_call = 0
+
+    def _key(self):
+        return "youtube-quota:{}".format(quota_day().isoformat())
+
+    def spend(self, units):
+        key = self._key()
+        used = self.redis.incrby(key, units)
+        if used == units:
+            self.redis.expire(key, 2 * 24 * 3600)
+        if used > self.daily_quota:
+            self.redis.decrby(key, units)
+            raise QuotaExhausted("YouTube API daily quota used up")
+
+    def exhaust(self):
+        # YouTube says the quota is used up, whatever the counter says
+        self.redis.set(self._key(), self.daily_quota, ex=2 * 24 * 3600)
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def parse_duration(duration):
+    # ISO 8601 durations as returned by videos().list, e.g. PT4M13S
+    match = _DURATION_RE.fullmatch(duration or "")
+    if match is None:
+        return None
+    parts = {k: int(v or 0) for k, v in match.groupdict().items()}
+    return (
+        parts["days"] * 86400
+        + parts["hours"] * 3600
+        + parts["minutes"] * 60
+        + parts["seconds"]
+    )
+
+
+def normalize_title(title):
+    title = _NOISE_RE.sub("", title.lower())
+    return " ".join(re.sub(r"[^\w\s]", " ", title).split())
+
+
+def score_candidate(name, artists, length, title, duration):
+    """Score a video from 0 to 1 as a match for a track.
+
+    Title similarity is weighted against how far the video's duration is
+    from the track's, relative to the track's length.
+    """
+    expected = normalize_title("{} {}".format(artists, name))
+    title = normalize_title(title)
+    # titles put the artist before or after the song name, so compare the
+    # words in sorted order as well
+    similarity = max(
+        SequenceMatcher(None, expected, title).ratio(),
+        SequenceMatcher(
+            None, " ".join(sorted(expected.split())), " ".join(sorted(title.split()))
+        ).ratio(),
+    )
+    weight = get_settings()["MATCH_TITLE_WEIGHT"]
+    if not length or duration is None:
+        return similarity * weight
+    delta = min(abs(duration - length) / float(length), 1.0)
+    return similarity * weight + (1 - delta) * (1 - weight)
+
+
+class Matcher(object):
+    """Finds the best YouTube video for each of a batch of tracks.
+
+    Tracks are searched concurrently, one search per track. The durations
+    of every candidate in the batch are then looked up together, 50 videos
+    per videos().list call, before the candidates are scored.
+    """
+
+    def __init__(
+        self,
+        limiter,
+        workers=None,
+        candidates=None,
+        min_score=None,
+    ):
+        settings = get_settings()
+        self.limiter = limiter
+        self.workers = workers or settings["YOUTUBE_SEARCH_WORKERS"]
+        self.candidates = candidates or settings["YOUTUBE_SEARCH_RESULTS"]
+        if min_score is None:
+            min_score = settings["MATCH_MIN_SCORE"]
+        self.min_score = min_score
+
+    def execute(self, request):
+        try:
+            return request.execute()
+        except Exception as exc:
+            if is_quota_error(exc):
+                self.limiter.exhaust()
+                raise QuotaExhausted("YouTube API daily quota used up")
+            raise
+
+    def search(self, name, artists):
+        self.limiter.wait()
+        self.limiter.spend(SEARCH_COST)
+        response = self.execute(
+            youtube_key_client()
+            .search()
+            .list(
+                part="snippet",
+                q="{} {}".format(name, artists),
+                type="video",
+                maxResults=self.candidates,
+            )
+        )
+        return [
+            (item["id"]["videoId"], item["snippet"]["title"])
+            for item in response.get("items", [])
+        ]
+
+    def durations(self, video_ids):
+        found = {}
+        for start in range(0, len(video_ids), 50):
+            chunk = video_ids[start:start + 50]
+            self.limiter.spend(VIDEOS_LIST_COST)
+            response = self.execute(
+                youtube_key_client()
+                .videos()
+                .list(part="contentDetails", id=",".join(chunk))
+            )
+            for item in response.get("items", []):
+                found[item["id"]] = parse_duration(
+                    item["contentDetails"].get("duration")
+                )
+        return found
+
+    def match(self, tracks):
+        """Match (key, name, artists, length) tuples.
+
+        Returns a dict of key to (video_id, score), with video_id None when
+        no candidate scored at least min_score. Tracks left out of the
+        result weren't searched because the quota ran out.
+        """
+        searched = {}
+
+        def search(track):
+            key, name, artists, length = track
+            try:
+                searched[key] = self.search(name, artists)
+            except QuotaExhausted:
+                pass
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(search, tracks))
+
+        video_ids = sorted(
+            set(v for found in searched.values() for v, _ in found)
+        )
+        try:
+            durations = self.durations(video_ids)
+        except QuotaExhausted:
+            durations = {}
+
+        matches = {}
+        for key, name, artists, length in tracks:
+            if key not in searched:
+                continue
+            best = (None, 0)
+            for video_id, title in searched[key]:
+                score = score_candidate(
+                    name, artists, length, title, durations.get(video_id)
+                )
+                if score > best[1]:
+                    best = (video_id, score)
+            if best[1] < self.min_score:
+                best = (None, best[1])
+            matches[key] = best
+        return matches
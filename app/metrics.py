@@ -0,0 +1,154 @@
+import os
+import time
+from contextlib import contextmanager
+
+from celery.signals import task_postrun, task_prerun
+from flask import g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry,
+                               Histogram, generate_latest)
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.redis_conn import get_redis
+
+
+# kombu keeps each priority level of a Redis queue in its own list
+PRIORITY_SEP = "\x06\x16"
+
+STAGE_SECONDS = Histogram(
+    "job_stage_seconds",
+    "Time spent in each stage of a background job",
+    ["task", "stage"],
+)
+TASK_SECONDS = Histogram(
+    "celery_task_seconds",
+    "Run time of Celery tasks",
+    ["task", "state"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, float("inf")),
+)
+REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "Time to handle a request, up to the first byte of streamed responses",
+    ["endpoint", "method", "status"],
+)
+SQL_SECONDS = Histogram(
+    "sql_query_seconds",
+    "Time spent executing SQL statements",
+    ["statement"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, float("inf")),
+)
+
+
+@contextmanager
+def timed(stage, task="scrape_spotify"):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(task, stage).observe(time.perf_counter() - start)
+
+
+class QueueDepthCollector(object):
+    # read from the broker whenever /metrics is scraped
+
+    def __init__(self, queues, priority_steps):
+        self.queues = queues
+        self.priority_steps = priority_steps
+
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            "celery_queue_depth", "Messages waiting in each queue", labels=["queue"]
+        )
+        keys = {
+            queue: [queue]
+            + [
+                "{}{}{}".format(queue, PRIORITY_SEP, step)
+                for step in self.priority_steps
+                if step
+            ]
+            for queue in self.queues
+        }
+        with get_redis().pipeline(transaction=False) as pipe:
+            for queue in self.queues:
+                for key in keys[queue]:
+                    pipe.llen(key)
+            lengths = iter(pipe.execute())
+        for queue in self.queues:
+            gauge.add_metric([queue], sum(next(lengths) for _ in keys[queue]))
+        yield gauge
+
+
+_queue_depth = None
+
+
+def register_queues(queues, priority_steps):
+    global _queue_depth
+    _queue_depth = QueueDepthCollector(queues, priority_steps)
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        REGISTRY.register(_queue_depth)
+
+
+def render():
+    """Return the body and content type of a /metrics response.
+
+    With PROMETHEUS_MULTIPROC_DIR set, the web and worker processes write
+    their samples there and every process's are reported.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        if _queue_depth is not None:
+            registry.register(_queue_depth)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+def record_request(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        REQUEST_SECONDS.labels(
+            request.endpoint or "unknown", request.method, response.status_code
+        ).observe(time.perf_counter() - start)
+    return response
+
+
+def init_app(app):
+    app.before_request(start_timer)
+    app.after_request(record_request)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start"].pop()
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+    SQL_SECONDS.labels(keyword).observe(time.perf_counter() - start)
+
+
+_task_starts = {}
+
+
+@task_prerun.connect
+def start_task(task_id=None, **kwargs):
+    _task_starts[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def record_task(task_id=None, task=None, state=None, **kwargs):
+    start = _task_starts.pop(task_id, None)
+    if start is not None:
+        TASK_SECONDS.labels(task.name, state or "UNKNOWN").observe(
+            time.perf_counter() - start
+        )
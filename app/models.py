@@ -1,9 +1,17 @@
 from datetime import datetime
+from flask import current_app
 from flask_login import UserMixin
-from sqlalchemy_utils import JSONType
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy_utils import JSONType, StringEncryptedType
+from sqlalchemy_utils.types.encrypted.encrypted_type import FernetEngine
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from app import db, login
+from app.codec import CompactTracks
+from app.user_cache import get_user_cache
+from app.youtube import quota_day
 
 
 class User(UserMixin, db.Model):
@@ -13,6 +21,8 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(128))
     job_ref = db.Column(db.String(36), index=True)
     current_job = db.relationship('Job', backref='user', lazy='dynamic')
+    youtube_quota_day = db.Column(db.Date)
+    youtube_quota_used = db.Column(db.Integer, default=0)
     
 
     def __repr__(self):
@@ -24,17 +34,396 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def spend_youtube_quota(self, units, budget):
+        # each user may only spend part of the project's daily quota
+        today = quota_day()
+        if self.youtube_quota_day != today:
+            self.youtube_quota_day = today
+            self.youtube_quota_used = 0
+        if (self.youtube_quota_used or 0) + units > budget:
+            return False
+        self.youtube_quota_used = (self.youtube_quota_used or 0) + units
+        return True
+
+
+# job_ref changes with every scrape and a memory cache can't be
+# invalidated from other processes, so it is always loaded from the
+# database when it is read
+UNCACHED_USER_COLUMNS = {'job_ref'}
+
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    # serves the user's columns from the cache when it can, attaching the
+    # rebuilt user to the session without a query
+    cache = get_user_cache()
+    if cache is None:
+        return User.query.get(int(id))
+    data = cache.get(int(id))
+    if data is not None:
+        user = User(**data)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    user = User.query.get(int(id))
+    if user is not None:
+        cache.set(
+            user.id,
+            {
+                c.key: getattr(user, c.key)
+                for c in User.__table__.columns
+                if c.key not in UNCACHED_USER_COLUMNS
+            },
+        )
+    return user
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_user(mapper, connection, user):
+    cache = get_user_cache()
+    if cache is not None:
+        cache.invalidate(user.id)
+
+
+class Track(db.Model):
+    # shared by every job that found it; local files have no spotify_id
+    id = db.Column(db.Integer, primary_key=True)
+    spotify_id = db.Column(db.String(32), index=True, unique=True)
+    name = db.Column(db.Text)
+    artists = db.Column(db.Text, index=True)
+    length = db.Column(db.Integer)
+    # set once a YouTube search has been made for the track, youtube_id
+    # stays empty if nothing matched well enough
+    youtube_id = db.Column(db.String(16))
+    match_score = db.Column(db.Float)
+    matched_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return "<Track {}>".format(self.name)
+
+    def to_row(self):
+        return [self.name, self.artists, self.length, self.spotify_id]
+
+
+class JobTrack(db.Model):
+    job_id = db.Column(db.String(36), db.ForeignKey('job.id'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    track_id = db.Column(db.Integer, db.ForeignKey('track.id'), index=True)
+    track = db.relationship('Track')
+
+    def __repr__(self):
+        return "<JobTrack {} {}>".format(self.job_id, self.position)
 
 
 class Job(db.Model):
+    # the history of each user is read newest first
+    __table_args__ = (db.Index('ix_job_user_id_timestamp', 'user_id', 'timestamp'),)
     id = db.Column(db.String(36), index=True, primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    result = db.Column(JSONType)
+    # songs of old jobs whose job_track rows were compacted into it
+    result = db.deferred(db.Column(CompactTracks(2 ** 32 - 1)))
+    compacted = db.Column(db.Boolean, default=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    playlist_id = db.Column(db.String(64), index=True)
+    playlist_name = db.Column(db.String(256))
+    snapshot_id = db.Column(db.String(64))
+    track_count = db.Column(db.Integer)
+    # why the scrape failed, kept after Celery's result has expired
+    error = db.Column(db.Text)
+    # set when the job joined another job's scrape of the same playlist
+    source_id = db.Column(db.String(36), db.ForeignKey('job.id'), index=True)
+    source = db.relationship('Job', remote_side=[id])
+    tracks = db.relationship(
+        'JobTrack',
+        lazy='dynamic',
+        order_by='JobTrack.position',
+        cascade='all, delete-orphan',
+    )
 
     def __repr__(self):
         return "<Job {}>".format(self.id)
+
+    @staticmethod
+    def history(user_id, limit, before=None):
+        """Return summaries of the user's jobs, newest first.
+
+        before is the (timestamp, id) of the last job of the previous page.
+        Only summary columns are read, never the stored results.
+        """
+        source = db.aliased(Job)
+        query = (
+            db.session.query(
+                Job.id,
+                Job.timestamp,
+                Job.playlist_id,
+                Job.playlist_name,
+                db.func.coalesce(Job.source_id, Job.id).label('result_id'),
+                db.func.coalesce(source.track_count, Job.track_count).label(
+                    'track_count'
+                ),
+                db.func.coalesce(source.error, Job.error).label('error'),
+            )
+            .outerjoin(source, Job.source_id == source.id)
+            .filter(Job.user_id == user_id)
+        )
+        if before is not None:
+            timestamp, job_id = before
+            query = query.filter(
+                db.or_(
+                    Job.timestamp < timestamp,
+                    db.and_(Job.timestamp == timestamp, Job.id < job_id),
+                )
+            )
+        return (
+            query.order_by(Job.timestamp.desc(), Job.id.desc()).limit(limit).all()
+        )
+
+    @property
+    def result_job(self):
+        # the job whose task scrapes the playlist and holds the songs
+        return self.source or self
+
+    @property
+    def is_complete(self):
+        return self.result_job.track_count is not None
+
+    def get_tracks(self, offset=0, limit=None):
+        """Return [name, artists, length, spotify_id] rows in playlist order."""
+        if self.source_id is not None:
+            return self.source.get_tracks(offset, limit)
+        if self.compacted:
+            rows = self.result or []
+            end = None if limit is None else offset + limit
+            return rows[offset:end]
+        # positions run 0..track_count-1, so seek on the primary key
+        # instead of making the database skip offset rows. Columns rather
+        # than Track entities, which the query would de-duplicate when a
+        # track is in the playlist twice.
+        query = (
+            db.session.query(
+                Track.name, Track.artists, Track.length, Track.spotify_id
+            )
+            .join(JobTrack, JobTrack.track_id == Track.id)
+            .filter(JobTrack.job_id == self.id, JobTrack.position >= offset)
+            .order_by(JobTrack.position)
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        return [list(row) for row in query]
+
+    def iter_tracks(self, batch_size=500):
+        # yields every row while holding at most one batch in memory
+        offset = 0
+        while True:
+            rows = self.get_tracks(offset, batch_size)
+            for row in rows:
+                yield row
+            if len(rows) < batch_size:
+                return
+            offset += batch_size
+
+    def unmatched_tracks(self):
+        # tracks of this job that have never been searched for on YouTube,
+        # in playlist order so transfers can move on as they are matched
+        return (
+            Track.query.join(JobTrack, JobTrack.track_id == Track.id)
+            .filter(
+                JobTrack.job_id == self.result_job.id,
+                Track.matched_at.is_(None),
+            )
+            .group_by(Track.id)
+            .order_by(db.func.min(JobTrack.position))
+            .all()
+        )
+
+    def first_unmatched_position(self):
+        # None once every track has been searched for
+        return (
+            db.session.query(db.func.min(JobTrack.position))
+            .join(Track, JobTrack.track_id == Track.id)
+            .filter(
+                JobTrack.job_id == self.result_job.id,
+                Track.matched_at.is_(None),
+            )
+            .scalar()
+        )
+
+    def save_tracks(self, rows, batch_size=500):
+        """Bulk insert the job's result rows, reusing known tracks."""
+        track_ids = []
+        for start in range(0, len(rows), batch_size):
+            track_ids.extend(_get_or_create_tracks(rows[start:start + batch_size]))
+        db.session.bulk_insert_mappings(
+            JobTrack,
+            [
+                {"job_id": self.id, "position": position, "track_id": track_id}
+                for position, track_id in enumerate(track_ids)
+            ],
+        )
+        self.track_count = len(rows)
+
+
+def _known_tracks(spotify_ids):
+    return dict(
+        db.session.query(Track.spotify_id, Track.id).filter(
+            Track.spotify_id.in_(spotify_ids)
+        )
+    )
+
+
+def _insert_tracks(mappings):
+    # another job may insert some of the same tracks at the same time, in
+    # which case the rest are inserted one at a time
+    try:
+        with db.session.begin_nested():
+            db.session.bulk_insert_mappings(Track, mappings)
+    except IntegrityError:
+        for mapping in mappings:
+            try:
+                with db.session.begin_nested():
+                    db.session.bulk_insert_mappings(Track, [mapping])
+            except IntegrityError:
+                pass
+
+
+def _get_or_create_tracks(rows):
+    # returns the Track primary key of every row, inserting unknown tracks
+    spotify_ids = set(row[3] for row in rows if len(row) > 3 and row[3])
+    known = {}
+    if spotify_ids:
+        known = _known_tracks(spotify_ids)
+    new_tracks = {}
+    for row in rows:
+        spotify_id = row[3] if len(row) > 3 else None
+        if spotify_id and spotify_id not in known:
+            new_tracks[spotify_id] = {
+                "spotify_id": spotify_id,
+                "name": row[0],
+                "artists": row[1],
+                "length": row[2],
+            }
+    if new_tracks:
+        _insert_tracks(list(new_tracks.values()))
+        known.update(_known_tracks(list(new_tracks)))
+
+    track_ids = []
+    for row in rows:
+        spotify_id = row[3] if len(row) > 3 else None
+        if spotify_id:
+            track_ids.append(known[spotify_id])
+        else:
+            track = Track(name=row[0], artists=row[1], length=row[2])
+            db.session.add(track)
+            db.session.flush()
+            track_ids.append(track.id)
+    return track_ids
+
+
+class PlaylistTransfer(db.Model):
+    # adds a job's matched videos to a YouTube playlist, position is the
+    # checkpoint of the next job_track position to add
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    job_id = db.Column(db.String(36), db.ForeignKey('job.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    youtube_playlist_id = db.Column(db.String(64))
+    status = db.Column(db.String(16), default="PENDING")
+    position = db.Column(db.Integer, default=0)
+    added = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    # positions before the checkpoint that the quota or a passing error
+    # stopped from being added
+    retry_positions = db.Column(JSONType)
+    # why a FAILED transfer stopped
+    error = db.Column(db.Text)
+    job = db.relationship('Job')
+    user = db.relationship('User')
+
+    def __repr__(self):
+        return "<PlaylistTransfer {}>".format(self.id)
+
+    def matched_videos(self, positions=None, limit=None, before=None):
+        """Return (position, youtube_id) pairs of matched tracks to add,
+        from the checkpoint onwards, up to position before if given, or at
+        the given positions."""
+        query = (
+            db.session.query(JobTrack.position, Track.youtube_id)
+            .join(Track, JobTrack.track_id == Track.id)
+            .filter(
+                JobTrack.job_id == self.job.result_job.id,
+                Track.youtube_id.isnot(None),
+            )
+            .order_by(JobTrack.position)
+        )
+        if positions is not None:
+            query = query.filter(JobTrack.position.in_(positions))
+        else:
+            query = query.filter(JobTrack.position >= self.position)
+            if before is not None:
+                query = query.filter(JobTrack.position < before)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+
+
+def _credentials_key():
+    key = current_app.config["CREDENTIALS_KEY"]
+    if not key:
+        raise RuntimeError("Set CREDENTIALS_KEY to store Google credentials")
+    return key
+
+
+class GoogleCredentials(db.Model):
+    # a user's Google OAuth tokens, encrypted at rest
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(
+        db.Integer, db.ForeignKey('user.id'), index=True, unique=True
+    )
+    token = db.Column(StringEncryptedType(db.String, _credentials_key, FernetEngine))
+    refresh_token = db.Column(
+        StringEncryptedType(db.String, _credentials_key, FernetEngine)
+    )
+    token_uri = db.Column(db.String(256))
+    client_id = db.Column(db.String(256))
+    client_secret = db.Column(
+        StringEncryptedType(db.String, _credentials_key, FernetEngine)
+    )
+    scopes = db.Column(JSONType)
+    expiry = db.Column(db.DateTime, index=True)
+    user = db.relationship(
+        'User', backref=db.backref('google_credentials', uselist=False)
+    )
+
+    def __repr__(self):
+        return "<GoogleCredentials {}>".format(self.user_id)
+
+    def to_credentials(self):
+        import google.oauth2.credentials
+
+        return google.oauth2.credentials.Credentials(
+            token=self.token,
+            refresh_token=self.refresh_token,
+            token_uri=self.token_uri,
+            client_id=self.client_id,
+            client_secret=self.client_secret,
+            scopes=self.scopes,
+            expiry=self.expiry,
+        )
+
+    def update_from(self, credentials):
+        # call after using the credentials, the token may have been refreshed
+        self.token = credentials.token
+        if credentials.refresh_token:
+            self.refresh_token = credentials.refresh_token
+        self.token_uri = credentials.token_uri
+        self.client_id = credentials.client_id
+        self.client_secret = credentials.client_secret
+        self.scopes = list(credentials.scopes or [])
+        self.expiry = credentials.expiry
+
+    @staticmethod
+    def save(user, credentials):
+        stored = user.google_credentials or GoogleCredentials(user=user)
+        stored.update_from(credentials)
+        db.session.add(stored)
+        return stored
@@ -0,0 +1,148 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from uuid import uuid4
+
+from celery.signals import task_postrun, task_prerun
+from flask import request
+from flask_login import current_user
+
+from app import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler(object):
+    """Samples the stacks of some threads from a background thread.
+
+    Every interval seconds the current stack of each watched thread is
+    recorded, all threads but the sampler when thread_ids is None. save()
+    writes them in the collapsed format read by flamegraph.pl and
+    speedscope, one "outer;...;inner count" line per distinct stack.
+    """
+
+    def __init__(self, interval, thread_ids=None):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.stacks = Counter()
+        self.started = None
+        self.duration = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.started = time.time()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.time() - self.started
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if self.thread_ids is not None and thread_id not in self.thread_ids:
+                    continue
+                self.stacks[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(
+                "{} ({}:{})".format(
+                    code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+                )
+            )
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def save(self, name):
+        directory = get_settings()["PROFILE_DIR"]
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(
+            directory,
+            "{}-{}-{}.folded".format(
+                name, time.strftime("%Y%m%d-%H%M%S"), uuid4().hex[:8]
+            ),
+        )
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("{} {}\n".format(stack, count))
+        return path
+
+
+def wants_profile():
+    # the config flag profiles every request to the listed endpoints, the
+    # header only works for admins
+    settings = get_settings()
+    if request.endpoint in settings["PROFILE_ENDPOINTS"]:
+        return True
+    if request.headers.get("X-Profile") != "1":
+        return False
+    return (
+        current_user.is_authenticated
+        and current_user.username in settings["PROFILE_ADMINS"]
+    )
+
+
+def start_request_profile():
+    settings = get_settings()
+    if not settings["PROFILE_ENDPOINTS"] and not settings["PROFILE_ADMINS"]:
+        return
+    if wants_profile():
+        request.environ["app.profiler"] = SamplingProfiler(
+            settings["PROFILE_INTERVAL"], {threading.get_ident()}
+        ).start()
+
+
+def stop_request_profile(response):
+    profiler = request.environ.get("app.profiler")
+    if profiler is None:
+        return response
+    name = "request-{}".format(request.endpoint)
+
+    # streamed responses are rendered after this, so stop once sent
+    def save():
+        profiler.stop()
+        logger.info("Profile of %s saved to %s", name, profiler.save(name))
+
+    response.call_on_close(save)
+    return response
+
+
+def init_app(app):
+    app.before_request(start_request_profile)
+    app.after_request(stop_request_profile)
+
+
+_task_profilers = {}
+
+
+@task_prerun.connect
+def start_task_profile(task_id=None, task=None, **kwargs):
+    settings = get_settings()
+    if task.name in settings["PROFILE_TASKS"]:
+        # tasks fetch pages on thread pools, so sample every thread
+        _task_profilers[task_id] = SamplingProfiler(
+            settings["PROFILE_INTERVAL"]
+        ).start()
+
+
+@task_postrun.connect
+def stop_task_profile(task_id=None, task=None, **kwargs):
+    profiler = _task_profilers.pop(task_id, None)
+    if profiler is not None:
+        profiler.stop()
+        name = "task-{}".format(task.name.rsplit(".", 1)[-1])
+        logger.info("Profile of %s saved to %s", name, profiler.save(name))
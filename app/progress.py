@@ -0,0 +1,87 @@
+import json
+import time
+
+from app.redis_conn import get_redis
+from app import get_settings
+
+
+FINISHED_STATES = ("SUCCESS", "FAILURE")
+
+
+def progress_channel(task_id):
+    return "task-progress:{}".format(task_id)
+
+
+def publish_progress(task_id, state, meta):
+    """Send a progress event to everyone watching the task.
+
+    The event has the same shape as a /task-status response.
+    """
+    event = dict(meta, state=state)
+    get_redis().publish(progress_channel(task_id), json.dumps(event))
+
+
+def report_progress(task, state, meta, task_id=None):
+    # store the state for pollers, then push it to subscribers
+    task_id = task_id or task.request.id
+    task.update_state(task_id=task_id, state=state, meta=meta)
+    publish_progress(task_id, state, meta)
+
+
+class ProgressReporter(object):
+    """Coalesces the progress updates of a long running task.
+
+    Every update goes through the result backend and pub/sub, so an update
+    is only sent when the status text changes, when current has moved by
+    at least min_delta, or when min_interval seconds have passed since the
+    last one. Anything else is dropped; the next update sent carries the
+    latest values. task_id lets a subtask report on behalf of its parent.
+    """
+
+    def __init__(
+        self,
+        task,
+        total=100,
+        min_interval=None,
+        min_delta=None,
+        task_id=None,
+    ):
+        settings = get_settings()
+        self.task = task
+        self.total = total
+        if min_interval is None:
+            min_interval = settings["PROGRESS_MIN_INTERVAL"]
+        if min_delta is None:
+            min_delta = settings["PROGRESS_MIN_DELTA"]
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self.task_id = task_id
+        self.last_sent = None
+        self.last_current = None
+        self.last_status = None
+
+    def _due(self, current, status, now):
+        if self.last_sent is None or status != self.last_status:
+            return True
+        if now - self.last_sent >= self.min_interval:
+            return True
+        return current - self.last_current >= self.min_delta
+
+    def update(self, current, status, force=False, **counts):
+        """Report progress, extra keyword arguments are sent as is."""
+        now = time.monotonic()
+        if not force and not self._due(current, status, now):
+            return False
+        meta = {"current": current, "total": self.total, "status": status}
+        meta.update(counts)
+        report_progress(self.task, "PROGRESS", meta, task_id=self.task_id)
+        self.last_sent = now
+        self.last_current = current
+        self.last_status = status
+        return True
+
+
+def subscribe(task_id):
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(progress_channel(task_id))
+    return pubsub
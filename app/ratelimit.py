@@ -0,0 +1,220 @@
+import random
+import time
+
+import requests
+
+from app import get_settings
+from app.redis_conn import get_redis
+
+
+# Refills the bucket for the time since the last call and takes a token.
+# Returns how many seconds the caller has to wait, 0 if it got a token.
+# Numbers are returned as strings, Redis would truncate Lua floats.
+_ACQUIRE = """
+local now = tonumber(ARGV[1])
+local max_rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'rate', 'blocked')
+local rate = tonumber(state[3]) or max_rate
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+local blocked = tonumber(state[4]) or 0
+if now < blocked then
+    return tostring(blocked - now)
+end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now, 'rate', rate)
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+"""
+
+# Called on a 429: stops everyone until Retry-After has passed and cuts
+# the rate, which then creeps back up with every successful call.
+_THROTTLED = """
+local now = tonumber(ARGV[1])
+local retry_after = tonumber(ARGV[2])
+local max_rate = tonumber(ARGV[3])
+local min_rate = tonumber(ARGV[4])
+local factor = tonumber(ARGV[5])
+local state = redis.call('HMGET', KEYS[1], 'rate', 'blocked')
+local rate = tonumber(state[1]) or max_rate
+local blocked = tonumber(state[2]) or 0
+rate = math.max(min_rate, rate * factor)
+blocked = math.max(blocked, now + retry_after)
+redis.call('HMSET', KEYS[1], 'rate', rate, 'blocked', blocked, 'tokens', 0, 'ts', blocked)
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(rate)
+"""
+
+_SUCCEEDED = """
+local max_rate = tonumber(ARGV[1])
+local step = tonumber(ARGV[2])
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate'))
+if rate and rate < max_rate then
+    redis.call('HSET', KEYS[1], 'rate', math.min(max_rate, rate + step))
+end
+return 0
+"""
+
+
+class Throttled(Exception):
+    pass
+
+
+class RateLimiter(object):
+    """Token bucket shared by every worker through a Redis hash.
+
+    The bucket refills at up to max_rate calls per second. When the API
+    answers 429, throttled() blocks all workers for the Retry-After period
+    and multiplies the rate by decrease; each later success adds increase
+    back, until the rate is at max_rate again.
+    """
+
+    def __init__(
+        self,
+        name,
+        max_rate,
+        burst,
+        min_rate=0.5,
+        decrease=0.5,
+        increase=0.5,
+        redis_client=None,
+    ):
+        self.key = "rate-limit:{}".format(name)
+        self.max_rate = max_rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.decrease = decrease
+        self.increase = increase
+        self.redis = redis_client or get_redis()
+        self._acquire = self.redis.register_script(_ACQUIRE)
+        self._throttled = self.redis.register_script(_THROTTLED)
+        self._succeeded = self.redis.register_script(_SUCCEEDED)
+
+    def acquire(self, max_wait=None):
+        # blocks until this worker may make a call, or raises Throttled if
+        # that would take more than max_wait seconds
+        waited = 0
+        while True:
+            wait = float(
+                self._acquire(
+                    keys=[self.key], args=[time.time(), self.max_rate, self.burst]
+                )
+            )
+            if wait <= 0:
+                return
+            if max_wait is not None and waited + wait > max_wait:
+                raise Throttled("Rate limited for {:.1f}s".format(wait))
+            time.sleep(wait)
+            waited += wait
+
+    def throttled(self, retry_after):
+        self._throttled(
+            keys=[self.key],
+            args=[
+                time.time(),
+                retry_after,
+                self.max_rate,
+                self.min_rate,
+                self.decrease,
+            ],
+        )
+
+    def succeeded(self):
+        self._succeeded(keys=[self.key], args=[self.max_rate, self.increase])
+
+
+_spotify_limiter = None
+_spotify_limiter_options = None
+
+
+def get_spotify_limiter():
+    # rebuilt if the settings change, e.g. for another app in tests
+    global _spotify_limiter, _spotify_limiter_options
+    settings = get_settings()
+    options = (
+        get_redis(),
+        settings["SPOTIFY_MAX_RATE"],
+        settings["SPOTIFY_RATE_BURST"],
+        settings["SPOTIFY_MIN_RATE"],
+    )
+    if _spotify_limiter is None or options != _spotify_limiter_options:
+        _spotify_limiter = RateLimiter(
+            "spotify",
+            settings["SPOTIFY_MAX_RATE"],
+            settings["SPOTIFY_RATE_BURST"],
+            min_rate=settings["SPOTIFY_MIN_RATE"],
+            redis_client=get_redis(),
+        )
+        _spotify_limiter_options = options
+    return _spotify_limiter
+
+
+def get_retry_after(exc):
+    headers = getattr(exc, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc):
+    from spotipy.exceptions import SpotifyException
+
+    if isinstance(exc, SpotifyException):
+        return exc.http_status == 429 or exc.http_status >= 500
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+
+def backoff(attempt, retry_after=None):
+    # full jitter, but never sooner than the server asked for
+    settings = get_settings()
+    cap = min(
+        settings["SPOTIFY_BACKOFF_MAX"],
+        settings["SPOTIFY_BACKOFF_BASE"] * 2 ** attempt,
+    )
+    delay = random.uniform(0, cap)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def call_with_retry(func, limiter=None, retries=None, max_wait=None):
+    """Call func under the rate limiter, retrying throttled calls and
+    transient errors with jittered exponential backoff.
+
+    With max_wait, no single wait for the limiter or before a retry may be
+    longer than max_wait seconds: Throttled or the last error is raised
+    instead.
+    """
+    from spotipy.exceptions import SpotifyException
+
+    if retries is None:
+        retries = get_settings()["SPOTIFY_RETRIES"]
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire(max_wait)
+        try:
+            result = func()
+        except (SpotifyException, requests.RequestException) as exc:
+            if attempt == retries or not is_retryable(exc):
+                raise
+            retry_after = get_retry_after(exc)
+            if limiter is not None and getattr(exc, "http_status", None) == 429:
+                limiter.throttled(
+                    retry_after or get_settings()["SPOTIFY_BACKOFF_BASE"]
+                )
+            delay = backoff(attempt, retry_after)
+            if max_wait is not None and delay > max_wait:
+                raise
+            time.sleep(delay)
+        else:
+            if limiter is not None:
+                limiter.succeeded()
+            return result
@@ -0,0 +1,17 @@
+import redis
+
+from app import get_settings
+
+
+_redis = None
+_redis_url = None
+
+
+def get_redis():
+    # one connection pool per process, shared by everything outside Celery
+    global _redis, _redis_url
+    url = get_settings()["REDIS_URL"]
+    if _redis is None or url != _redis_url:
+        _redis = redis.Redis.from_url(url, decode_responses=True)
+        _redis_url = url
+    return _redis
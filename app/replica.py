@@ -0,0 +1,40 @@
+from functools import wraps
+
+from flask import current_app
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import orm
+
+READ_BIND = "read"
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends the queries of read only views to the replica.
+
+    Only views wrapped in read_only() are routed, and only when the "read"
+    bind is configured. Flushes always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if (
+            self.info.get("read_only")
+            and not self._flushing
+            and READ_BIND in (self.app.config["SQLALCHEMY_BINDS"] or {})
+        ):
+            return get_state(self.app).db.get_engine(self.app, bind=READ_BIND)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def read_only(f):
+    # the replica may lag behind, so only for views that can show
+    # slightly old data
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        get_state(current_app).db.session.info["read_only"] = True
+        return f(*args, **kwargs)
+
+    return decorated_function
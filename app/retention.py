@@ -0,0 +1,116 @@
+from app import db
+from app.models import Job, JobTrack, PlaylistTransfer, Track, User
+
+
+def _in_use():
+    # jobs that must keep their job_track rows: each user's current job
+    # and the job it joined, jobs others joined, and jobs with a transfer
+    # still going
+    current = db.session.query(User.job_ref).filter(User.job_ref.isnot(None))
+    current_sources = (
+        db.session.query(Job.source_id)
+        .join(User, User.job_ref == Job.id)
+        .filter(Job.source_id.isnot(None))
+    )
+    sources = db.session.query(Job.source_id).filter(Job.source_id.isnot(None))
+    transferring = (
+        db.session.query(PlaylistTransfer.job_id)
+        .filter(
+            PlaylistTransfer.job_id.isnot(None),
+            PlaylistTransfer.status != "COMPLETE",
+        )
+    )
+    transferring_sources = (
+        db.session.query(Job.source_id)
+        .join(PlaylistTransfer, PlaylistTransfer.job_id == Job.id)
+        .filter(
+            Job.source_id.isnot(None), PlaylistTransfer.status != "COMPLETE"
+        )
+    )
+    return current, current_sources, sources, transferring, transferring_sources
+
+
+def compact_jobs(before, batch_size):
+    """Move the songs of jobs finished before the given time from job_track
+    rows into the job's compact result, and return how many were moved."""
+    current, current_sources, _, transferring, transferring_sources = _in_use()
+    compacted = 0
+    while True:
+        jobs = (
+            Job.query.filter(
+                Job.timestamp < before,
+                Job.track_count.isnot(None),
+                Job.compacted.isnot(True),
+                Job.source_id.is_(None),
+                ~Job.id.in_(current),
+                ~Job.id.in_(current_sources),
+                ~Job.id.in_(transferring),
+                ~Job.id.in_(transferring_sources),
+            )
+            .limit(batch_size)
+            .all()
+        )
+        if not jobs:
+            return compacted
+        for job in jobs:
+            job.result = job.get_tracks()
+            job.compacted = True
+            JobTrack.query.filter_by(job_id=job.id).delete(
+                synchronize_session=False
+            )
+        db.session.commit()
+        compacted += len(jobs)
+
+
+def delete_jobs(before, batch_size):
+    """Delete jobs created before the given time that nothing refers to
+    any more, and return how many were deleted."""
+    current, _, sources, _, _ = _in_use()
+    transfers = db.session.query(PlaylistTransfer.job_id).filter(
+        PlaylistTransfer.job_id.isnot(None)
+    )
+    deleted = 0
+    while True:
+        ids = [
+            job_id
+            for job_id, in db.session.query(Job.id)
+            .filter(
+                Job.timestamp < before,
+                ~Job.id.in_(current),
+                ~Job.id.in_(sources),
+                ~Job.id.in_(transfers),
+            )
+            .limit(batch_size)
+        ]
+        if not ids:
+            return deleted
+        JobTrack.query.filter(JobTrack.job_id.in_(ids)).delete(
+            synchronize_session=False
+        )
+        Job.query.filter(Job.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+
+
+def delete_orphan_tracks(batch_size):
+    """Delete tracks no job refers to, and return how many were deleted.
+
+    Tracks with a YouTube match are kept, so the search isn't paid for
+    again when the song turns up in another playlist.
+    """
+    linked = db.session.query(JobTrack.track_id).filter(
+        JobTrack.track_id.isnot(None)
+    )
+    deleted = 0
+    while True:
+        ids = [
+            track_id
+            for track_id, in db.session.query(Track.id)
+            .filter(Track.matched_at.is_(None), ~Track.id.in_(linked))
+            .limit(batch_size)
+        ]
+        if not ids:
+            return deleted
+        Track.query.filter(Track.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
@@ -1,57 +1,75 @@
 import json
+import time
+from datetime import datetime
+from uuid import uuid4
 
-import google.oauth2.credentials
-import google_auth_oauthlib.flow
-import googleapiclient.discovery
 import requests
-from flask import (flash, jsonify, redirect, render_template, request, session,
+from celery import chain
+from flask import (Blueprint, abort, current_app, flash, jsonify, redirect,
+                   render_template, request, session, stream_with_context,
                    url_for)
 from flask_login import current_user, login_required, login_user, logout_user
 from werkzeug.urls import url_parse
 
-from app import app, db
+from app import db, metrics, progress
+from app.clients import get_spotify_client, youtube_client
 from app.forms import (LoginForm, RegistrationForm, SpotifyPlaylistSearch,
                        YTPlaylistName)
-from app.models import Job, User
-from app.tasks import scrape_spotify
+from app.models import GoogleCredentials, Job, PlaylistTransfer, User
+from app.ratelimit import Throttled, get_spotify_limiter, is_retryable
+from app.replica import read_only
+from app.scraper import fetch_playlist_summary
+from app.tasks import (WAITING_STATUS, claim_scrape, enqueue_scrape,
+                       match_youtube, release_scrape, scrape_spotify,
+                       transfer_playlist)
 
+# This variable specifies the name of a file that contains the OAuth 2.0
+# information for this application, including its client_id and client_secret.
+CLIENT_SECRETS_FILE = "client_secret.json"
 
-@app.route("/")
-@app.route("/index")
+# This OAuth 2.0 access scope allows for full read/write access to the
+# authenticated user's account and requires requests to use an SSL connection.
+SCOPES = ["https://www.googleapis.com/auth/youtube.force-ssl"]
+
+bp = Blueprint("main", __name__)
+
+
+@bp.route("/")
+@bp.route("/index")
 def index():
     if current_user.is_authenticated:
         return render_template("home.html")
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for("spotify"))
+        return redirect(url_for("main.spotify"))
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
         if user is None or not user.check_password(form.password.data):
             flash("Invalid username or password")
-            return redirect(url_for("login"))
+            return redirect(url_for("main.login"))
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get("next")
         if not next_page or url_parse(next_page).netloc != "":
-            next_page = url_for("index")
+            next_page = url_for("main.index")
         return redirect(next_page)
     return render_template("login.html", title="Log In", form=form)
 
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     logout_user()
-    return redirect(url_for("index"))
+    return redirect(url_for("main.index"))
 
 
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for("spotify"))
+        return redirect(url_for("main.spotify"))
     form = RegistrationForm()
     if form.validate_on_submit():
         user = User(username=form.username.data, email=form.email.data)
@@ -59,11 +77,11 @@ def register():
         db.session.add(user)
         db.session.commit()
         flash("You are now registerd, please log in.")
-        return redirect(url_for("login"))
+        return redirect(url_for("main.login"))
     return render_template("register.html", title="Register", form=form)
 
 
-@app.route("/spotify", methods=["POST", "GET"])
+@bp.route("/spotify", methods=["POST", "GET"])
 @login_required
 def spotify():
     form = SpotifyPlaylistSearch()
@@ -72,28 +90,97 @@ def spotify():
     )
 
 
-@app.route("/scrape_spotify", methods=["POST"])
+@bp.route("/scrape_spotify", methods=["POST"])
 @login_required
 def start_spotify_search():
+    import MySpotify
+
+    from spotipy.exceptions import SpotifyException
+
     input_str = request.form["playlist"]
-    task = scrape_spotify.delay(input_str)
-    task_description = Job(id=task.id, user_id=current_user.id)
-    current_user.job_ref = task.id
+    try:
+        playlist_id = MySpotify.select_playlist(input_str)
+    except Exception:
+        # whatever the user typed isn't a playlist link, URI or ID
+        return jsonify({"error": "Not a Spotify playlist"}), 400
+    # sizes the job, so small playlists don't queue behind big ones
+    try:
+        playlist_summary = fetch_playlist_summary(
+            get_spotify_client(),
+            playlist_id,
+            get_spotify_limiter(),
+            retries=current_app.config["SPOTIFY_REQUEST_RETRIES"],
+            max_wait=current_app.config["SPOTIFY_REQUEST_MAX_WAIT"],
+        )
+    except SpotifyException as exc:
+        if exc.http_status in (400, 404):
+            return jsonify({"error": "Playlist not found"}), 400
+        if not is_retryable(exc):
+            raise
+        return jsonify({"error": "Spotify is busy, try again shortly"}), 503
+    except (Throttled, requests.RequestException):
+        return jsonify({"error": "Spotify is busy, try again shortly"}), 503
+    # the job row has to exist before the task can save its result to it,
+    # and before another job can join it
+    job_id = str(uuid4())
+    task_description = Job(
+        id=job_id,
+        user_id=current_user.id,
+        playlist_id=playlist_id,
+        playlist_name=playlist_summary.get("name"),
+    )
+    current_user.job_ref = job_id
     db.session.add(task_description)
     db.session.commit()
+    running = claim_scrape(playlist_id, job_id)
+    if running is None:
+        try:
+            enqueue_scrape(
+                input_str,
+                job_id,
+                current_user.id,
+                playlist_summary["tracks"]["total"],
+            )
+        except Exception:
+            # or later submissions would join a scrape that never runs
+            release_scrape(playlist_id, job_id)
+            raise
+    else:
+        task_description.source_id = running
+        db.session.commit()
 
     return (
-        jsonify({}),
+        jsonify(
+            {
+                "events": url_for("main.task_events", task_id=job_id),
+                "songs": url_for("main.display_spotify_songs", job_id=job_id),
+            }
+        ),
         202,
-        {"Location": url_for("task_status", task_id=task.id)},
+        {"Location": url_for("main.task_status", task_id=job_id)},
     )
 
 
-@app.route("/task-status/<task_id>")
-def task_status(task_id):
-    task = scrape_spotify.AsyncResult(task_id)
+def get_task_status(job):
+    task = scrape_spotify.AsyncResult(job.result_job.id)
+
+    if job.is_complete or task.state == "SUCCESS":
+        response = {
+            "state": "SUCCESS",
+            "current": 1,
+            "total": 1,
+            "status": "Success!",
+        }
+
+    elif job.result_job.error is not None:
+        response = {
+            "state": "FAILURE",
+            "current": 1,
+            "total": 1,
+            "status": job.result_job.error,
+        }
 
-    if task.state == "PENDING":
+    elif task.state == "PENDING":
         # job hasn't started yet
         response = {
             "state": task.state,
@@ -102,18 +189,14 @@ def task_status(task_id):
             "status": "Pending...",
         }
 
-    if task.state == "SUCCESS":
-        this_task = Job.query.get(task_id)
-        this_task.result = task.get()
-        db.session.commit()
-
+    elif task.state == "RETRY":
+        # waiting for a free slot, which the page shows as still pending
         response = {
-            "state": task.state,
-            "current": 1,
+            "state": "PENDING",
+            "current": 0,
             "total": 1,
-            "status": "Success!",
+            "status": WAITING_STATUS,
         }
-        return response
 
     elif task.state != "FAILURE":
         response = {
@@ -132,35 +215,206 @@ def task_status(task_id):
             "status": str(task.info),
         }
 
-    return jsonify(response)
+    return response
 
 
-@app.route("/show_songs", methods=["GET"])
+@bp.route("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return current_app.response_class(body, content_type=content_type)
+
+
+@bp.route("/task-status/<task_id>")
+def task_status(task_id):
+    # the task saves its own result, so this only ever reads
+    job = Job.query.get_or_404(task_id)
+    return jsonify(get_task_status(job))
+
+
+@bp.route("/task-events/<task_id>")
+def task_events(task_id):
+    # Server-Sent Events stream of the task's progress, ending once the
+    # task has finished. Subscribe before reading the current state so no
+    # event published in between is lost.
+    job = Job.query.get_or_404(task_id)
+    pubsub = progress.subscribe(job.result_job.id)
+    response = get_task_status(job)
+    keepalive = current_app.config["TASK_EVENTS_KEEPALIVE"]
+    max_age = current_app.config["TASK_EVENTS_MAX_AGE"]
+    pending_timeout = current_app.config["TASK_EVENTS_PENDING_TIMEOUT"]
+
+    def events(response):
+        # each stream holds a worker and a Redis connection, so it ends
+        # after max_age, or sooner if the task never starts, and the
+        # client carries on polling /task-status
+        started = updated = time.monotonic()
+        try:
+            yield "data: {}\n\n".format(json.dumps(response))
+            while response["state"] not in progress.FINISHED_STATES:
+                now = time.monotonic()
+                if now - started > max_age or (
+                    response["state"] == "PENDING" and now - updated > pending_timeout
+                ):
+                    break
+                message = pubsub.get_message(timeout=keepalive)
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                updated = time.monotonic()
+                response = json.loads(message["data"])
+                yield "data: {}\n\n".format(message["data"])
+        finally:
+            pubsub.close()
+
+    return current_app.response_class(
+        events(response),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def stream_template(template_name, **context):
+    # render the template in chunks as the response is sent
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(50)
+    return stream
+
+
+@bp.route("/show_songs", methods=["GET"])
+@login_required
 def display_spotify_songs():
     # Render table displaying songs found.
-    # Use session variable to find songs
-    result = Job.query.get(current_user.job_ref).result
+    # Rows are read from the database in batches while the page streams,
+    # so memory use doesn't grow with the size of the playlist.
+    job_id = request.args.get("job_id", current_user.job_ref)
+    job = Job.query.get_or_404(job_id)
+    if job.user_id != current_user.id:
+        abort(404)
+    return current_app.response_class(
+        stream_with_context(
+            stream_template("show_songs.html", songs=job.iter_tracks())
+        )
+    )
+
+
+@bp.route("/api/jobs/<job_id>/songs", methods=["GET"])
+@login_required
+def job_songs(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.user_id != current_user.id:
+        abort(404)
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = request.args.get(
+        "limit", current_app.config["SONGS_PER_PAGE"], type=int
+    )
+    limit = min(max(limit, 1), current_app.config["MAX_SONGS_PER_PAGE"])
+
+    songs = job.get_tracks(offset, limit)
+    total = job.result_job.track_count
+    next_url = None
+    if total is not None and offset + len(songs) < total:
+        next_url = url_for(
+            "main.job_songs", job_id=job_id, offset=offset + limit, limit=limit
+        )
+    return jsonify(
+        {
+            "songs": songs,
+            "offset": offset,
+            "limit": limit,
+            "total": total,
+            "next": next_url,
+        }
+    )
+
+
+def parse_cursor(cursor):
+    # "<timestamp>_<job id>" of the last job on the previous page
+    try:
+        timestamp, job_id = cursor.split("_", 1)
+        return datetime.fromisoformat(timestamp), job_id
+    except ValueError:
+        abort(400)
+
+
+def job_history():
+    """Return the current page of the user's jobs and the cursor of the
+    next one, None on the last page."""
+    cursor = request.args.get("before")
+    before = parse_cursor(cursor) if cursor else None
+    per_page = current_app.config["JOBS_PER_PAGE"]
+    # one extra row tells whether there is another page
+    rows = Job.history(current_user.id, per_page + 1, before)
+    jobs = []
+    for row in rows[:per_page]:
+        if row.track_count is not None:
+            state = "SUCCESS"
+        elif row.error is not None:
+            state = "FAILURE"
+        else:
+            state = scrape_spotify.AsyncResult(row.result_id).state
+        jobs.append(
+            {
+                "id": row.id,
+                "timestamp": row.timestamp.isoformat(),
+                "playlist_id": row.playlist_id,
+                "playlist_name": row.playlist_name,
+                "track_count": row.track_count,
+                "state": state,
+                "songs": url_for("main.job_songs", job_id=row.id),
+            }
+        )
+    next_cursor = None
+    if len(rows) > per_page:
+        last = rows[per_page - 1]
+        next_cursor = "{}_{}".format(last.timestamp.isoformat(), last.id)
+    return jobs, next_cursor
+
+
+@bp.route("/jobs", methods=["GET"])
+@login_required
+@read_only
+def jobs():
+    history, next_cursor = job_history()
     return render_template(
-        "show_songs.html", songs=result
+        "jobs.html", title="History", jobs=history, next_cursor=next_cursor
     )
 
 
-@app.route("/create_playlist", methods=["POST", "GET"])
+@bp.route("/api/jobs", methods=["GET"])
+@login_required
+@read_only
+def api_jobs():
+    history, next_cursor = job_history()
+    next_url = None
+    if next_cursor is not None:
+        next_url = url_for("main.api_jobs", before=next_cursor)
+    return jsonify({"jobs": history, "next": next_url})
+
+
+@bp.route("/create_playlist", methods=["POST", "GET"])
+@login_required
 def yt_create_playlist():
 
     # if playlist name was submitted using POST
     if request.method == "POST":
-        if "credentials" not in session:
+        stored = current_user.google_credentials
+        if stored is None:
             return redirect("authorize")
-
-        # Load credentials from the session.
-        credentials = google.oauth2.credentials.Credentials(
-            **session["credentials"]
+        # only a finished scrape has songs to transfer
+        job = (
+            Job.query.get(current_user.job_ref)
+            if current_user.job_ref is not None
+            else None
         )
+        if job is None or not job.is_complete:
+            abort(400)
+
+        # Load the user's stored credentials.
+        credentials = stored.to_credentials()
         # Create a youtube object
-        youtube = googleapiclient.discovery.build(
-            API_SERVICE_NAME, API_VERSION, credentials=credentials
-        )
+        youtube = youtube_client(credentials)
         result = request.form
 
         yt_create_playlist = youtube.playlists().insert(
@@ -174,51 +428,84 @@ def yt_create_playlist():
         )
         response = yt_create_playlist.execute()
 
-        # Save credentials back to session in case access token was refreshed.
-        # ACTION ITEM: In a production app, you likely want to save these
-        #              credentials in a persistent database instead.
-        session["credentials"] = credentials_to_dict(credentials)
+        # Save credentials back in case access token was refreshed.
+        stored.update_from(credentials)
 
-        return response["id"]
+        # match the songs of the user's last job, then add them
+        transfer = PlaylistTransfer(
+            job_id=job.id,
+            user_id=current_user.id,
+            youtube_playlist_id=response["id"],
+        )
+        db.session.add(transfer)
+        db.session.commit()
+        chain(
+            match_youtube.si(transfer.job_id),
+            transfer_playlist.si(transfer.id),
+        ).delay()
+
+        return (
+            jsonify({"id": response["id"]}),
+            202,
+            {"Location": url_for("main.transfer_status", transfer_id=transfer.id)},
+        )
 
     form = YTPlaylistName()
     return render_template("create_playlist.html", form=form)
 
+@bp.route("/transfer-status/<int:transfer_id>")
+@login_required
+def transfer_status(transfer_id):
+    transfer = PlaylistTransfer.query.get_or_404(transfer_id)
+    if transfer.user_id != current_user.id:
+        abort(404)
+    return jsonify(
+        {
+            "status": transfer.status,
+            "playlist": transfer.youtube_playlist_id,
+            "added": transfer.added,
+            "failed": transfer.failed,
+            "position": transfer.position,
+            "total": transfer.job.result_job.track_count,
+            "error": transfer.error,
+        }
+    )
+
 # ---------------------------------------------------------------------------
 # ---------------------------Google/Youtube Auth-----------------------------
 # ---------------------------------------------------------------------------
-@app.route("/test")
+@bp.route("/test")
+@login_required
 def test_api_request():
-    if "credentials" not in session:
+    stored = current_user.google_credentials
+    if stored is None:
         return redirect("authorize")
 
-    # Load credentials from the session.
-    credentials = google.oauth2.credentials.Credentials(
-        **session["credentials"]
-    )
+    # Load the user's stored credentials.
+    credentials = stored.to_credentials()
 
-    youtube = googleapiclient.discovery.build(
-        API_SERVICE_NAME, API_VERSION, credentials=credentials
-    )
+    youtube = youtube_client(credentials)
 
     channel = youtube.channels().list(mine=True, part="snippet").execute()
 
-    # Save credentials back to session in case access token was refreshed.
-    # ACTION ITEM: In a production app, you likely want to save these
-    #              credentials in a persistent database instead.
-    session["credentials"] = credentials_to_dict(credentials)
+    # Save credentials back in case access token was refreshed.
+    stored.update_from(credentials)
+    db.session.commit()
 
     return jsonify(**channel)
 
 
-@app.route("/authorize")
+@bp.route("/authorize")
+@login_required
 def authorize():
+    import google_auth_oauthlib.flow
+
     # Create flow instance to manage the OAuth 2.0 Authorization Grant Flow steps.
     flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
         CLIENT_SECRETS_FILE, scopes=SCOPES
     )
 
-    flow.redirect_uri = url_for("oauth2callback", _external=True)
+    flow.redirect_uri = url_for("main.oauth2callback", _external=True)
 
     authorization_url, state = flow.authorization_url(
         # Enable offline access so that you can refresh an access token without
@@ -234,8 +521,11 @@ def authorize():
     return redirect(authorization_url)
 
 
-@app.route("/oauth2callback")
+@bp.route("/oauth2callback")
+@login_required
 def oauth2callback():
+    import google_auth_oauthlib.flow
+
     # Specify the state when creating the flow in the callback so that it can
     # verified in the authorization server response.
     state = session["state"]
@@ -243,32 +533,32 @@ def oauth2callback():
     flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
         CLIENT_SECRETS_FILE, scopes=SCOPES, state=state
     )
-    flow.redirect_uri = url_for("oauth2callback", _external=True)
+    flow.redirect_uri = url_for("main.oauth2callback", _external=True)
 
     # Use the authorization server's response to fetch the OAuth 2.0 tokens.
     authorization_response = request.url
     flow.fetch_token(authorization_response=authorization_response)
 
-    # Store credentials in the session.
-    # ACTION ITEM: In a production app, you likely want to save these
-    #              credentials in a persistent database instead.
+    # Store credentials with the user, encrypted, so background tasks can
+    # use them and refresh them before they expire.
     credentials = flow.credentials
-    session["credentials"] = credentials_to_dict(credentials)
+    GoogleCredentials.save(current_user, credentials)
+    db.session.commit()
 
-    return redirect(url_for("test_api_request"))
+    return redirect(url_for("main.test_api_request"))
 
 
-@app.route("/revoke")
+@bp.route("/revoke")
+@login_required
 def revoke():
-    if "credentials" not in session:
+    stored = current_user.google_credentials
+    if stored is None:
         return (
             'You need to <a href="/authorize">authorize</a> before '
             + "testing the code to revoke credentials."
         )
 
-    credentials = google.oauth2.credentials.Credentials(
-        **session["credentials"]
-    )
+    credentials = stored.to_credentials()
 
     revoke = requests.post(
         "https://accounts.google.com/o/oauth2/revoke",
@@ -278,19 +568,23 @@ def revoke():
 
     status_code = getattr(revoke, "status_code")
     if status_code == 200:
+        db.session.delete(stored)
+        db.session.commit()
         return "Credentials successfully revoked." + print_index_table()
     else:
         return "An error occurred." + print_index_table()
 
 
-@app.route("/clear")
+@bp.route("/clear")
+@login_required
 def clear_credentials():
-    if "credentials" in session:
-        del session["credentials"]
+    if current_user.google_credentials is not None:
+        db.session.delete(current_user.google_credentials)
+        db.session.commit()
     return "Credentials have been cleared.<br><br>" + print_index_table()
 
 
-@app.route("/main")
+@bp.route("/main")
 def print_sidebar_page():
     return render_template(
         "main.html",
@@ -301,17 +595,6 @@ def print_sidebar_page():
     )
 
 
-def credentials_to_dict(credentials):
-    return {
-        "token": credentials.token,
-        "refresh_token": credentials.refresh_token,
-        "token_uri": credentials.token_uri,
-        "client_id": credentials.client_id,
-        "client_secret": credentials.client_secret,
-        "scopes": credentials.scopes,
-    }
-
-
 def print_index_table():
     return (
         "<table>"
@@ -328,8 +611,8 @@ def print_index_table():
         + "    session. After revoking credentials, if you go to the test "
         + "    page, you should see an <code>invalid_grant</code> error."
         + "</td></tr>"
-        + '<tr><td><a href="/clear">Clear Flask session credentials</a></td>'
-        + "<td>Clear the access token currently stored in the user session. "
+        + '<tr><td><a href="/clear">Clear stored credentials</a></td>'
+        + "<td>Clear the access token currently stored for the user. "
         + '    After clearing the token, if you <a href="/test">test the '
         + "    API request</a> again, you should go back to the auth flow."
         + "</td></tr></table>"
@@ -0,0 +1,170 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app import get_settings
+from app.metrics import timed
+from app.ratelimit import call_with_retry
+
+
+# what scraping needs to know about a playlist, leaving out the first page
+# of tracks Spotify would otherwise send along
+SUMMARY_FIELDS = "id,name,snapshot_id,owner(id),tracks(total)"
+
+
+def fetch_playlist_summary(
+    spotify_client,
+    playlist_id,
+    limiter=None,
+    retries=None,
+    max_wait=None,
+):
+    return call_with_retry(
+        lambda: spotify_client.playlist(playlist_id, fields=SUMMARY_FIELDS),
+        limiter,
+        retries,
+        max_wait,
+    )
+
+
+def get_offsets(num_loops, step=None):
+    if step is None:
+        step = get_settings()["SPOTIFY_PAGE_SIZE"]
+    return [i * step for i in range(0, num_loops)]
+
+
+def fetch_playlist_pages(
+    spotify_client,
+    playlist_summary,
+    offsets,
+    max_workers=None,
+    on_page=None,
+    fields=None,
+    limiter=None,
+):
+    """Fetch the playlist pages starting at each offset.
+
+    Requests run on a bounded thread pool, so at most max_workers pages are
+    in flight at once. Pages are returned in the order of offsets, whatever
+    order they complete in. on_page is called with each page from the
+    calling thread as it arrives, which keeps progress reporting off the
+    workers.
+    fields is passed through to Spotify to trim the returned items. Each
+    page goes through limiter and is retried on its own if Spotify throttles
+    it or fails.
+    """
+    settings = get_settings()
+    page_size = settings["SPOTIFY_PAGE_SIZE"]
+    if max_workers is None:
+        max_workers = settings["SPOTIFY_FETCH_WORKERS"]
+
+    def fetch(offset):
+        # includes time spent waiting on the limiter and retrying
+        with timed("fetch_page"):
+            return call_with_retry(
+                lambda: spotify_client.user_playlist_tracks(
+                    user=playlist_summary["owner"]["id"],
+                    playlist_id=playlist_summary["id"],
+                    limit=page_size,
+                    offset=offset,
+                    fields=fields,
+                ),
+                limiter,
+            )
+
+    pages = [None] * len(offsets)
+    workers = max(1, min(max_workers, len(offsets)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fetch, offset): i for i, offset in enumerate(offsets)
+        }
+        try:
+            for future in as_completed(futures):
+                page = future.result()
+                pages[futures[future]] = page
+                if on_page is not None:
+                    on_page(page)
+        except BaseException:
+            # the scrape has failed, so don't fetch the pages still queued
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    return pages
+
+
+def get_track_id(item):
+    # local files and removed tracks have no Spotify ID
+    track = item.get("track")
+    if track is None:
+        return None
+    return track.get("id")
+
+
+def scrape_page(items, track_cache=None):
+    """Parse a page of playlist items into [name, artists, length, id] rows.
+
+    Tracks found in track_cache are reused as-is, so only tracks no job has
+    seen before go through MySpotify.scrape_songs. Those are then added to
+    the cache for later jobs.
+    """
+    import MySpotify
+
+    track_ids = [get_track_id(item) for item in items]
+    cached = {}
+    if track_cache is not None:
+        cached = track_cache.get_many([i for i in track_ids if i])
+
+    rows = []
+    new_tracks = {}
+    for item, track_id in zip(items, track_ids):
+        if track_id in cached:
+            rows.append(cached[track_id] + [track_id])
+            continue
+        parsed = MySpotify.scrape_songs([item])
+        rows.extend(list(row) + [track_id] for row in parsed)
+        if track_id and parsed:
+            new_tracks[track_id] = list(parsed[0])
+
+    if track_cache is not None and new_tracks:
+        track_cache.set_many(new_tracks)
+    return rows
+
+
+def fetch_track_ids(
+    spotify_client, playlist_summary, offsets, on_page=None, limiter=None
+):
+    """Fetch only the track IDs on each page, which is far cheaper to
+    transfer than the full track objects."""
+    return fetch_playlist_pages(
+        spotify_client,
+        playlist_summary,
+        offsets,
+        on_page=on_page,
+        fields="items(track(id))",
+        limiter=limiter,
+    )
+
+
+def find_stale_pages(id_pages, known_tracks):
+    # a page has to be fetched in full if any of its tracks is new
+    stale = []
+    for i, page in enumerate(id_pages):
+        for item in page["items"]:
+            if get_track_id(item) not in known_tracks:
+                stale.append(i)
+                break
+    return stale
+
+
+def merge_pages(id_pages, known_tracks, full_pages, track_cache=None):
+    """Rebuild the playlist in order from known tracks and refetched pages.
+
+    full_pages maps a page index to its full Spotify page. Every other page
+    is assembled from known_tracks, a dict of track ID to result row.
+    """
+    rows = []
+    for i, page in enumerate(id_pages):
+        if i in full_pages:
+            rows.extend(scrape_page(full_pages[i]["items"], track_cache))
+        else:
+            rows.extend(
+                known_tracks[get_track_id(item)] for item in page["items"]
+            )
+    return rows
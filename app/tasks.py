@@ -1,65 +1,715 @@
-import MySpotify
-from celery import Celery
+import time as clock
+from datetime import datetime, timedelta
 
+from celery import Celery, chain, chord
+from celery.exceptions import Ignore
+from kombu import Queue
+from redis.exceptions import WatchError
 
-CELERY_BROKER_URL = "redis://localhost:6379/0"
-CELERY_RESULT_BACKEND = "redis://localhost:6379/0"
+from app import db, get_settings
+from app.clients import get_spotify_client, youtube_client
+from app.codec import pack_tracks, unpack_tracks
+from app.matching import Matcher, QuotaExhausted, QuotaLimiter
+from app.metrics import register_queues, timed
+from app.models import GoogleCredentials, Job, PlaylistTransfer
+from app.progress import ProgressReporter, publish_progress
+from app.ratelimit import get_spotify_limiter
+from app.redis_conn import get_redis
+from app.retention import compact_jobs, delete_jobs, delete_orphan_tracks
+from app.scraper import (fetch_playlist_pages, fetch_playlist_summary,
+                         fetch_track_ids, find_stale_pages, get_offsets,
+                         merge_pages, scrape_page)
+from app.track_cache import get_track_cache
+from app.youtube import (INSERT_COST, insert_videos,
+                         seconds_until_quota_reset)
+
+
+CELERY_BROKER_URL = get_settings()["REDIS_URL"]
+CELERY_RESULT_BACKEND = get_settings()["REDIS_URL"]
 
 celery = Celery(
     "tasks", backend=CELERY_RESULT_BACKEND, broker=CELERY_BROKER_URL
 )
+SMALL_QUEUE = "scrape-small"
+LARGE_QUEUE = "scrape-large"
 
+# small scrapes get workers of their own, see README
+celery.conf.task_queues = (
+    Queue("celery", routing_key="celery"),
+    Queue(SMALL_QUEUE, routing_key=SMALL_QUEUE),
+    Queue(LARGE_QUEUE, routing_key=LARGE_QUEUE),
+)
+# a worker only takes a job when it is free, so queued jobs can still be
+# picked up by whichever worker frees up first
+celery.conf.worker_prefetch_multiplier = 1
+celery.conf.task_acks_late = True
+# messages with lower priority numbers are taken first within a queue;
+# the queues themselves are read round robin, so a worker for
+# celery,scrape-large still takes large scrapes while celery is busy
+celery.conf.broker_transport_options = {
+    "priority_steps": list(range(10)),
+}
+register_queues(
+    [queue.name for queue in celery.conf.task_queues],
+    celery.conf.broker_transport_options["priority_steps"],
+)
+# results are zlib compressed, see app.codec
+celery.conf.result_serializer = "compact"
+celery.conf.accept_content = ["json", "compact"]
+celery.conf.result_accept_content = ["json", "compact"]
+celery.conf.result_expires = get_settings()["CELERY_RESULT_EXPIRES"]
+celery.conf.beat_schedule = {
+    "refresh-google-credentials": {
+        "task": "app.tasks.refresh_google_credentials",
+        "schedule": get_settings()["CREDENTIALS_REFRESH_INTERVAL"],
+    },
+    "prune-jobs": {
+        "task": "app.tasks.prune_jobs",
+        "schedule": get_settings()["RETENTION_INTERVAL"],
+    },
+}
 
-@celery.task(bind=True)
-# returns list of songs - artists - song length
-def scrape_spotify(self, playlist):
-    current_prog = 5
-    self.update_state(
-        state="PROGRESS",
-        meta={
-            "current": current_prog,
-            "total": 100,
-            "status": "Looking for playlist...",
-        },
+flask_app = None
+
+
+def init_app(app):
+    """Run the tasks in app and take the Celery settings from its config.
+
+    The tasks read the rest of their settings through get_settings when
+    they run, so they follow the config of app as well.
+    """
+    global flask_app
+    flask_app = app
+    celery.conf.update(
+        broker_url=app.config["REDIS_URL"],
+        result_backend=app.config["REDIS_URL"],
+        result_expires=app.config["CELERY_RESULT_EXPIRES"],
     )
-    playlist_id = MySpotify.select_playlist(playlist)
-    playlist_summary = MySpotify.get_playlist_summary(playlist_id)
-    current_prog = 10
-    self.update_state(
-        state="PROGRESS",
-        meta={
-            "current": current_prog,
-            "total": 100,
-            "status": "Playlist found.",
-        },
+    schedule = celery.conf.beat_schedule
+    schedule["refresh-google-credentials"]["schedule"] = app.config[
+        "CREDENTIALS_REFRESH_INTERVAL"
+    ]
+    schedule["prune-jobs"]["schedule"] = app.config["RETENTION_INTERVAL"]
+
+
+def get_app():
+    # the app from create_app, or a worker one when started with -A app.tasks
+    if flask_app is None:
+        from app import create_app
+
+        create_app(web=False)
+    return flask_app
+
+
+class ProgressTask(celery.Task):
+    # tells event stream subscribers when the task has finished
+
+    def on_success(self, retval, task_id, args, kwargs):
+        publish_progress(
+            task_id, "SUCCESS", {"current": 1, "total": 1, "status": "Success!"}
+        )
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        publish_progress(
+            task_id, "FAILURE", {"current": 1, "total": 1, "status": str(exc)}
+        )
+
+
+class ScrapeTask(ProgressTask):
+    # keeps the failure on the job, since Celery's result expires
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        super().on_failure(exc, task_id, args, kwargs, einfo)
+        save_failure(task_id, exc)
+
+
+def save_failure(job_id, exc):
+    with get_app().app_context():
+        job = Job.query.get(job_id)
+        if job is not None:
+            job.error = str(exc) or type(exc).__name__
+            db.session.commit()
+
+
+def inflight_key(playlist_id):
+    return "scrape-inflight:{}".format(playlist_id)
+
+
+def claim_scrape(playlist_id, job_id):
+    """Return the job already scraping the playlist, or None after making
+    job_id the one that scrapes it."""
+    redis = get_redis()
+    key = inflight_key(playlist_id)
+    ttl = get_settings()["SCRAPE_INFLIGHT_TTL"]
+    while True:
+        if redis.set(key, job_id, nx=True, ex=ttl):
+            return None
+        running = redis.get(key)
+        if running is not None:
+            return running
+        # the running scrape finished in between, try again
+
+
+def release_scrape(playlist_id, job_id):
+    # only the job holding the claim may release it
+    redis = get_redis()
+    key = inflight_key(playlist_id)
+    with redis.pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            if pipe.get(key) == job_id:
+                pipe.multi()
+                pipe.delete(key)
+                pipe.execute()
+        except WatchError:
+            pass
+
+
+# shown while a scrape waits for one of the user's other scrapes
+WAITING_STATUS = "Waiting for your other playlists..."
+
+
+def user_scrapes_key(user_id):
+    return "user-scrapes:{}".format(user_id)
+
+
+def running_scrapes(user_id):
+    redis = get_redis()
+    key = user_scrapes_key(user_id)
+    # drop claims left behind by workers that died
+    ttl = get_settings()["SCRAPE_INFLIGHT_TTL"]
+    redis.zremrangebyscore(key, 0, clock.time() - ttl)
+    return redis.zcard(key)
+
+
+def claim_user_slot(user_id, job_id):
+    # True if the user has a free slot, which job_id then holds
+    redis = get_redis()
+    key = user_scrapes_key(user_id)
+    running_scrapes(user_id)
+    with redis.pipeline() as pipe:
+        pipe.zadd(key, {job_id: clock.time()})
+        pipe.expire(key, get_settings()["SCRAPE_INFLIGHT_TTL"])
+        pipe.zrank(key, job_id)
+        rank = pipe.execute()[2]
+    if rank < get_settings()["USER_MAX_SCRAPES"]:
+        return True
+    redis.zrem(key, job_id)
+    return False
+
+
+def release_user_slot(user_id, job_id):
+    get_redis().zrem(user_scrapes_key(user_id), job_id)
+
+
+def release_claims(playlist_id, job_id, user_id):
+    release_scrape(playlist_id, job_id)
+    if user_id is not None:
+        release_user_slot(user_id, job_id)
+
+
+def enqueue_scrape(playlist, job_id, user_id, track_total):
+    """Queue the scrape by playlist size, ahead of the jobs of users who
+    already have scrapes running."""
+    if track_total <= get_settings()["SMALL_JOB_MAX_TRACKS"]:
+        queue = SMALL_QUEUE
+    else:
+        queue = LARGE_QUEUE
+    return scrape_spotify.apply_async(
+        args=[playlist],
+        kwargs={"user_id": user_id},
+        task_id=job_id,
+        queue=queue,
+        priority=min(running_scrapes(user_id), 9),
     )
-    # this one takes longer, maybe bring code into function here to update
-    # status of task
-    num_loops = MySpotify.get_loops(playlist_summary)
-    iter_prog = 90 / num_loops
-    spotify_client = MySpotify.get_spotify_client()
-    step = 100
-    offset = 0
-    playlist_tracks = []
-    for i in range(0, num_loops):
-        self.update_state(
-            state="PROGRESS",
-            meta={
-                "current": current_prog,
-                "total": 100,
-                "status": "Getting songs...",
+
+
+def get_previous_result(playlist_id):
+    # most recent finished conversion of the same playlist, if any
+    with get_app().app_context():
+        job = (
+            Job.query.filter(
+                Job.playlist_id == playlist_id, Job.track_count.isnot(None)
+            )
+            .order_by(Job.timestamp.desc())
+            .first()
+        )
+        if job is None:
+            return None, None
+        return job.snapshot_id, job.get_tracks()
+
+
+def save_result(job_id, playlist_id, snapshot_id, tracks):
+    # writes the songs to the job once, as soon as the scrape finishes
+    with get_app().app_context(), timed("persist"):
+        job = Job.query.get(job_id)
+        if job is None:
+            job = Job(id=job_id)
+            db.session.add(job)
+        job.playlist_id = playlist_id
+        job.snapshot_id = snapshot_id
+        job.save_tracks(tracks)
+        db.session.commit()
+        return job.track_count
+
+
+@celery.task(bind=True, base=ScrapeTask, max_retries=None)
+# saves the list of songs - artists - song length - track id to the job
+# with the same id as the task, and returns the number of songs
+def scrape_spotify(self, playlist, user_id=None):
+    import MySpotify
+
+    with timed("select_playlist"):
+        playlist_id = MySpotify.select_playlist(playlist)
+    if user_id is not None and not claim_user_slot(user_id, self.request.id):
+        # wait for one of the user's other scrapes to finish
+        publish_progress(
+            self.request.id,
+            "PENDING",
+            {
+                "current": 0,
+                "total": 1,
+                "status": WAITING_STATUS,
             },
         )
-        result = spotify_client.user_playlist_tracks(
-            user=playlist_summary["owner"]["id"],
-            playlist_id=playlist_summary["id"],
-            limit=step,
-            offset=offset,
+        raise self.retry(countdown=get_settings()["USER_SCRAPE_RETRY_DELAY"])
+    fanned_out = False
+    try:
+        return _scrape_spotify(self, playlist_id, user_id)
+    except Ignore:
+        # replaced by chunk tasks, merge_chunks releases the claims
+        fanned_out = True
+        raise
+    finally:
+        if not fanned_out:
+            release_claims(playlist_id, self.request.id, user_id)
+
+
+def _scrape_spotify(self, playlist_id, user_id):
+    import MySpotify
+
+    progress = ProgressReporter(self)
+    progress.update(5, "Looking for playlist...")
+    limiter = get_spotify_limiter()
+    with timed("summary"):
+        playlist_summary = fetch_playlist_summary(
+            get_spotify_client(), playlist_id, limiter
         )
-        playlist_query = MySpotify.scrape_songs(result["items"])
-        for song_item in playlist_query:
-            playlist_tracks.append(song_item)
-        offset += step
-        current_prog += iter_prog
+    snapshot_id = playlist_summary.get("snapshot_id")
+    progress.update(10, "Playlist found.")
 
-    return playlist_tracks
+    previous_snapshot, previous_tracks = get_previous_result(playlist_id)
+    if (
+        previous_tracks is not None
+        and snapshot_id is not None
+        and previous_snapshot == snapshot_id
+    ):
+        # playlist hasn't changed since it was last converted
+        return save_result(
+            self.request.id, playlist_id, snapshot_id, previous_tracks
+        )
+
+    num_loops = MySpotify.get_loops(playlist_summary)
+    offsets = get_offsets(num_loops)
+    spotify_client = get_spotify_client()
+    track_cache = get_track_cache()
+    # pages to fetch, which grows if an incremental scrape finds stale pages
+    pages_total = num_loops
+    pages_done = 0
+    tracks_found = 0
+
+    def page_fetched(page):
+        nonlocal pages_done
+        pages_done += 1
+        progress.update(
+            10 + 90 * pages_done / pages_total,
+            "Getting songs...",
+            pages=pages_done,
+            total_pages=pages_total,
+            tracks=tracks_found,
+            total_tracks=playlist_summary["tracks"]["total"],
+        )
+
+    def page_done(page):
+        nonlocal tracks_found
+        tracks_found += len(page["items"])
+        page_fetched(page)
+
+    if (
+        previous_tracks is None
+        and playlist_summary["tracks"]["total"]
+        >= get_settings()["SCRAPE_FANOUT_MIN_TRACKS"]
+    ):
+        return fan_out(self, playlist_id, playlist_summary, offsets, user_id)
+
+    if previous_tracks is None:
+        with timed("fetch"):
+            pages = fetch_playlist_pages(
+                spotify_client,
+                playlist_summary,
+                offsets,
+                on_page=page_done,
+                limiter=limiter,
+            )
+        playlist_tracks = []
+        with timed("parse"):
+            for result in pages:
+                playlist_query = scrape_page(result["items"], track_cache)
+                for song_item in playlist_query:
+                    playlist_tracks.append(song_item)
+    else:
+        # only refetch the pages holding tracks the last result didn't have
+        known_tracks = {
+            row[3]: row for row in previous_tracks if len(row) > 3 and row[3]
+        }
+        with timed("fetch"):
+            id_pages = fetch_track_ids(
+                spotify_client,
+                playlist_summary,
+                offsets,
+                on_page=page_done,
+                limiter=limiter,
+            )
+            stale = find_stale_pages(id_pages, known_tracks)
+            pages_total += len(stale)
+            pages = fetch_playlist_pages(
+                spotify_client,
+                playlist_summary,
+                [offsets[i] for i in stale],
+                on_page=page_fetched,
+                limiter=limiter,
+            )
+        with timed("parse"):
+            playlist_tracks = merge_pages(
+                id_pages, known_tracks, dict(zip(stale, pages)), track_cache
+            )
+
+    return save_result(self.request.id, playlist_id, snapshot_id, playlist_tracks)
+
+
+def chunk_progress_key(job_id):
+    return "scrape-chunks:{}".format(job_id)
+
+
+def fan_out(self, playlist_id, playlist_summary, offsets, user_id):
+    """Replace the scrape with a chord of chunk tasks.
+
+    The merge callback takes over the task's id, so its result and state
+    are those of the job, and the chunks report progress on it too.
+    """
+    job_id = self.request.id
+    get_redis().delete(chunk_progress_key(job_id))
+    # the chunks only need enough of the summary to page through it
+    summary = {
+        "id": playlist_summary["id"],
+        "owner": {"id": playlist_summary["owner"]["id"]},
+        "tracks": {"total": playlist_summary["tracks"]["total"]},
+    }
+    step = get_settings()["SCRAPE_CHUNK_PAGES"]
+    chunks = [
+        scrape_chunk.s(
+            summary, offsets[start:start + step], job_id, len(offsets)
+        ).set(queue=LARGE_QUEUE)
+        for start in range(0, len(offsets), step)
+    ]
+    callback = merge_chunks.s(
+        playlist_id, playlist_summary.get("snapshot_id"), user_id
+    ).set(queue=LARGE_QUEUE)
+    callback.link_error(scrape_failed.s(playlist_id, user_id))
+    return self.replace(chord(chunks, callback))
+
+
+@celery.task(bind=True)
+# fetches and scrapes the pages at offsets for the parent job, and returns
+# their rows in playlist order, packed by pack_tracks
+def scrape_chunk(self, playlist_summary, offsets, parent_id, pages_total):
+    progress = ProgressReporter(self, task_id=parent_id)
+    redis = get_redis()
+    key = chunk_progress_key(parent_id)
+
+    def page_fetched(page):
+        # totals are kept in Redis, since the chunks run on many workers
+        with redis.pipeline() as pipe:
+            pipe.hincrby(key, "pages", 1)
+            pipe.hincrby(key, "tracks", len(page["items"]))
+            pipe.expire(key, get_settings()["SCRAPE_INFLIGHT_TTL"])
+            pages_done, tracks_found, _ = pipe.execute()
+        progress.update(
+            10 + 90 * pages_done / pages_total,
+            "Getting songs...",
+            pages=pages_done,
+            total_pages=pages_total,
+            tracks=tracks_found,
+            total_tracks=playlist_summary["tracks"]["total"],
+        )
+
+    with timed("fetch", task="scrape_chunk"):
+        pages = fetch_playlist_pages(
+            get_spotify_client(),
+            playlist_summary,
+            offsets,
+            on_page=page_fetched,
+            limiter=get_spotify_limiter(),
+        )
+    track_cache = get_track_cache()
+    rows = []
+    with timed("parse", task="scrape_chunk"):
+        for page in pages:
+            rows.extend(scrape_page(page["items"], track_cache))
+    return pack_tracks(rows)
+
+
+@celery.task(bind=True, base=ScrapeTask)
+# joins the chunks of a fanned out scrape, in order, saves them to the job
+# and returns the number of songs
+def merge_chunks(self, chunks, playlist_id, snapshot_id, user_id):
+    try:
+        tracks = [row for packed in chunks for row in unpack_tracks(packed)]
+        return save_result(self.request.id, playlist_id, snapshot_id, tracks)
+    finally:
+        get_redis().delete(chunk_progress_key(self.request.id))
+        release_claims(playlist_id, self.request.id, user_id)
+
+
+@celery.task
+# runs in place of merge_chunks when a chunk fails
+def scrape_failed(request, exc, traceback, playlist_id, user_id):
+    get_redis().delete(chunk_progress_key(request.id))
+    release_claims(playlist_id, request.id, user_id)
+    publish_progress(
+        request.id, "FAILURE", {"current": 1, "total": 1, "status": str(exc)}
+    )
+    save_failure(request.id, exc)
+
+
+def claim_tracks(tracks, timeout=600):
+    # stops two jobs from spending a search on the same track at once
+    redis = get_redis()
+    return [
+        track
+        for track in tracks
+        if redis.set("youtube-match:{}".format(track.id), 1, nx=True, ex=timeout)
+    ]
+
+
+def release_tracks(tracks):
+    if tracks:
+        get_redis().delete(*["youtube-match:{}".format(t.id) for t in tracks])
+
+
+@celery.task(bind=True, base=ProgressTask)
+# finds a YouTube video for each track of the job that has never been
+# matched, and returns the number of tracks searched for
+def match_youtube(self, job_id):
+    progress = ProgressReporter(self)
+    settings = get_settings()
+    limiter = QuotaLimiter(
+        settings["YOUTUBE_DAILY_QUOTA"], settings["YOUTUBE_SEARCHES_PER_SECOND"]
+    )
+    matcher = Matcher(limiter)
+    searched = 0
+    with get_app().app_context():
+        tracks = Job.query.get(job_id).unmatched_tracks()
+        step = settings["MATCH_BATCH_SIZE"]
+        for start in range(0, len(tracks), step):
+            batch = claim_tracks(tracks[start:start + step])
+            try:
+                matches = matcher.match(
+                    [(t.id, t.name, t.artists, t.length) for t in batch]
+                )
+                now = datetime.utcnow()
+                for track in batch:
+                    if track.id in matches:
+                        track.youtube_id, track.match_score = matches[track.id]
+                        track.matched_at = now
+                db.session.commit()
+            finally:
+                release_tracks(batch)
+            searched += len(matches)
+            progress.update(
+                100 * (start + step) / len(tracks),
+                "Matching songs...",
+                tracks=min(start + step, len(tracks)),
+                total_tracks=len(tracks),
+            )
+            if len(matches) < len(batch):
+                # quota ran out, the rest are matched on the next run
+                break
+    return searched
+
+
+REVOKED_ERROR = "Google access was revoked, authorize the app again"
+
+
+def fail_transfer(transfer, error):
+    transfer.status = "FAILED"
+    transfer.error = error
+    db.session.commit()
+    return transfer.added
+
+
+@celery.task(bind=True, base=ProgressTask, max_retries=None)
+# adds the matched videos of the transfer's job to its YouTube playlist,
+# carrying on from the last checkpoint, and returns the number added.
+# errors counts the runs in a row that ended with inserts to try again.
+def transfer_playlist(self, transfer_id, errors=0):
+    from google.auth.exceptions import RefreshError
+
+    progress = ProgressReporter(self)
+    settings = get_settings()
+    limiter = QuotaLimiter(
+        settings["YOUTUBE_DAILY_QUOTA"], settings["YOUTUBE_SEARCHES_PER_SECOND"]
+    )
+    with get_app().app_context():
+        transfer = PlaylistTransfer.query.get(transfer_id)
+        if transfer.status == "COMPLETE":
+            return transfer.added
+        stored = transfer.user.google_credentials
+        if stored is None:
+            # access was revoked, the user has to authorize again
+            return fail_transfer(transfer, REVOKED_ERROR)
+        transfer.status = "RUNNING"
+        db.session.commit()
+        credentials = stored.to_credentials()
+        youtube = youtube_client(credentials)
+        total = transfer.job.result_job.track_count or 0
+        # the checkpoint can't pass tracks that haven't been searched for
+        # yet, or they would be skipped once they are matched
+        unmatched = transfer.job.first_unmatched_position()
+
+        while True:
+            retrying = bool(transfer.retry_positions)
+            if retrying:
+                videos = transfer.matched_videos(positions=transfer.retry_positions)
+            else:
+                videos = transfer.matched_videos(
+                    limit=settings["YOUTUBE_INSERT_BATCH_SIZE"], before=unmatched
+                )
+            if not videos:
+                break
+
+            units = INSERT_COST * len(videos)
+            try:
+                if not transfer.user.spend_youtube_quota(
+                    units, settings["YOUTUBE_USER_DAILY_QUOTA"]
+                ):
+                    raise QuotaExhausted("Daily YouTube quota used up")
+                limiter.spend(units)
+            except QuotaExhausted as exc:
+                db.session.rollback()
+                transfer.status = "PAUSED"
+                db.session.commit()
+                raise self.retry(exc=exc, countdown=seconds_until_quota_reset())
+
+            try:
+                added, failed, retry, quota_hit = insert_videos(
+                    youtube,
+                    transfer.youtube_playlist_id,
+                    videos,
+                    ordered=not settings["YOUTUBE_INSERT_UNORDERED"],
+                )
+            except RefreshError:
+                db.session.rollback()
+                return fail_transfer(transfer, REVOKED_ERROR)
+            except Exception as exc:
+                db.session.rollback()
+                fail_transfer(transfer, str(exc) or type(exc).__name__)
+                raise
+            # checkpoint, so a restart carries on after this batch
+            stored.update_from(credentials)
+            transfer.added += len(added)
+            transfer.failed += len(failed)
+            if not retrying:
+                transfer.position = videos[-1][0] + 1
+            transfer.retry_positions = sorted(retry + quota_hit) or None
+            if retry and not quota_hit:
+                errors += 1
+                if errors > settings["YOUTUBE_INSERT_RETRIES"]:
+                    return fail_transfer(
+                        transfer, "YouTube kept refusing to add videos"
+                    )
+            elif not quota_hit:
+                errors = 0
+            if retry or quota_hit:
+                transfer.status = "PAUSED"
+            db.session.commit()
+
+            progress.update(
+                100 * transfer.position / max(total, 1),
+                "Adding videos...",
+                added=transfer.added,
+                failed=transfer.failed,
+            )
+            if quota_hit:
+                limiter.exhaust()
+                raise self.retry(countdown=seconds_until_quota_reset())
+            if retry:
+                raise self.retry(
+                    countdown=30 * 2 ** errors, kwargs={"errors": errors}
+                )
+
+        if unmatched is not None:
+            # the search quota ran out, match the rest once it resets
+            transfer.status = "PAUSED"
+            transfer.position = max(transfer.position, unmatched)
+            db.session.commit()
+            chain(
+                match_youtube.si(transfer.job_id),
+                transfer_playlist.si(transfer_id),
+            ).apply_async(countdown=seconds_until_quota_reset())
+            return transfer.added
+
+        transfer.status = "COMPLETE"
+        transfer.position = total
+        db.session.commit()
+        return transfer.added
+
+
+@celery.task
+# renews Google access tokens shortly before they expire, so requests and
+# tasks never have to refresh them inline
+def refresh_google_credentials():
+    import google.auth.transport.requests
+    from google.auth.exceptions import RefreshError
+
+    refreshed = 0
+    with get_app().app_context():
+        soon = datetime.utcnow() + timedelta(
+            seconds=get_settings()["CREDENTIALS_REFRESH_MARGIN"]
+        )
+        expiring = GoogleCredentials.query.filter(
+            GoogleCredentials.expiry.isnot(None), GoogleCredentials.expiry < soon
+        ).all()
+        request = google.auth.transport.requests.Request()
+        for stored in expiring:
+            credentials = stored.to_credentials()
+            if not credentials.refresh_token:
+                continue
+            try:
+                credentials.refresh(request)
+            except RefreshError:
+                # access was revoked, the user has to authorize again
+                db.session.delete(stored)
+            else:
+                stored.update_from(credentials)
+                refreshed += 1
+            db.session.commit()
+    return refreshed
+
+
+@celery.task
+# compacts the songs of old jobs, deletes jobs past retention and the
+# tracks they leave behind, and returns how many rows each step touched
+def prune_jobs():
+    now = datetime.utcnow()
+    settings = get_settings()
+    batch_size = settings["RETENTION_BATCH_SIZE"]
+    with get_app().app_context():
+        compacted = compact_jobs(
+            now - timedelta(days=settings["JOB_COMPACT_DAYS"]), batch_size
+        )
+        deleted = delete_jobs(
+            now - timedelta(days=settings["JOB_RETENTION_DAYS"]), batch_size
+        )
+        tracks = delete_orphan_tracks(batch_size)
+    return {"compacted": compacted, "deleted": deleted, "tracks": tracks}
@@ -0,0 +1,84 @@
+import json
+import time
+
+from app import get_settings
+from app.redis_conn import get_redis
+
+
+class TrackCache(object):
+    """Parsed track rows keyed by Spotify track ID, shared between workers.
+
+    Each row is stored under its own key with a TTL. A sorted set keeps the
+    last access time of every cached track so the cache can be trimmed back
+    to max_size by dropping the least recently used entries.
+    """
+
+    def __init__(self, client, ttl, max_size, prefix="track-cache"):
+        self.client = client
+        self.ttl = ttl
+        self.max_size = max_size
+        self.prefix = prefix
+        self.lru_key = "{}:lru".format(prefix)
+
+    def _key(self, track_id):
+        return "{}:{}".format(self.prefix, track_id)
+
+    def get_many(self, track_ids):
+        if not track_ids:
+            return {}
+        values = self.client.mget([self._key(i) for i in track_ids])
+        found = {}
+        for track_id, value in zip(track_ids, values):
+            if value is not None:
+                found[track_id] = json.loads(value)
+        if found:
+            # hits refresh both the LRU position and the TTL
+            now = time.time()
+            pipe = self.client.pipeline(transaction=False)
+            pipe.zadd(self.lru_key, {i: now for i in found})
+            for track_id in found:
+                pipe.expire(self._key(track_id), self.ttl)
+            pipe.execute()
+        return found
+
+    def set_many(self, rows):
+        if not rows:
+            return
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        for track_id, row in rows.items():
+            pipe.set(self._key(track_id), json.dumps(row), ex=self.ttl)
+        pipe.zadd(self.lru_key, {i: now for i in rows})
+        pipe.execute()
+        self._evict(now)
+
+    def _evict(self, now):
+        # entries not touched within the TTL have already expired
+        self.client.zremrangebyscore(self.lru_key, "-inf", now - self.ttl)
+        excess = self.client.zcard(self.lru_key) - self.max_size
+        if excess <= 0:
+            return
+        stale = self.client.zpopmin(self.lru_key, excess)
+        if stale:
+            self.client.delete(*[self._key(i) for i, _ in stale])
+
+
+_track_cache = None
+_track_cache_options = None
+
+
+def get_track_cache():
+    # rebuilt if the settings change, e.g. for another app in tests
+    global _track_cache, _track_cache_options
+    settings = get_settings()
+    if not settings["TRACK_CACHE_ENABLED"]:
+        return None
+    options = (
+        get_redis(),
+        settings["TRACK_CACHE_TTL"],
+        settings["TRACK_CACHE_MAX_SIZE"],
+    )
+    if _track_cache is None or options != _track_cache_options:
+        _track_cache = TrackCache(*options)
+        _track_cache_options = options
+    return _track_cache
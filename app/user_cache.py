@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+
+from kombu.utils.json import dumps, loads
+
+from app import get_settings
+from app.redis_conn import get_redis
+
+
+class MemoryUserCache(object):
+    """User columns keyed by user id, kept in this process for ttl seconds.
+
+    Other processes can't invalidate it, so ttl bounds how long they may
+    see an old row. Past max_size the least recently used user is dropped.
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires < time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return data
+
+    def set(self, user_id, data):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + self.ttl, data)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+
+class RedisUserCache(object):
+    # shared by every web process, so an update is seen by all of them
+
+    def __init__(self, client, ttl, prefix="user-cache"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, user_id):
+        return "{}:{}".format(self.prefix, user_id)
+
+    def get(self, user_id):
+        value = self.client.get(self._key(user_id))
+        if value is None:
+            return None
+        return loads(value)
+
+    def set(self, user_id, data):
+        self.client.set(self._key(user_id), dumps(data), ex=self.ttl)
+
+    def invalidate(self, user_id):
+        self.client.delete(self._key(user_id))
+
+
+_user_cache = None
+_user_cache_options = None
+
+
+def get_user_cache():
+    # rebuilt if the settings change, e.g. for another app in tests
+    global _user_cache, _user_cache_options
+    settings = get_settings()
+    ttl = settings["USER_CACHE_TTL"]
+    if not ttl:
+        return None
+    backend = settings["USER_CACHE_BACKEND"]
+    options = (backend, ttl, settings["USER_CACHE_MAX_SIZE"])
+    if backend == "redis":
+        options += (get_redis(),)
+    if _user_cache is None or options != _user_cache_options:
+        if backend == "redis":
+            _user_cache = RedisUserCache(get_redis(), ttl)
+        else:
+            _user_cache = MemoryUserCache(ttl, settings["USER_CACHE_MAX_SIZE"])
+        _user_cache_options = options
+    return _user_cache
@@ -0,0 +1,124 @@
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+# quota cost of one playlistItems().insert call
+INSERT_COST = 50
+
+# YouTube's daily quotas reset at midnight Pacific time
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+
+def quota_day():
+    return datetime.now(QUOTA_TIMEZONE).date()
+
+
+def seconds_until_quota_reset(now=None):
+    now = time.time() if now is None else now
+    today = datetime.fromtimestamp(now, QUOTA_TIMEZONE).date()
+    tomorrow = datetime.combine(
+        today + timedelta(days=1), datetime.min.time(), QUOTA_TIMEZONE
+    )
+    return int(tomorrow.timestamp() - now) + 60
+
+
+def is_quota_error(error):
+    from googleapiclient.errors import HttpError
+
+    return (
+        isinstance(error, HttpError)
+        and error.resp.status in (403, 429)
+        and b"quotaExceeded" in (error.content or b"")
+    )
+
+
+def is_transient_error(error):
+    # YouTube answers inserts racing into one playlist with 409s and
+    # 5xx backendErrors, which go away when the insert is tried again
+    import httplib2
+    from google.auth.exceptions import TransportError
+    from googleapiclient.errors import HttpError
+
+    if isinstance(error, HttpError):
+        return error.resp.status in (409, 429) or error.resp.status >= 500
+    return isinstance(error, (httplib2.HttpLib2Error, TransportError, OSError))
+
+
+def _insert_request(youtube, playlist_id, video_id):
+    return youtube.playlistItems().insert(
+        part="snippet",
+        body={
+            "snippet": {
+                "playlistId": playlist_id,
+                "resourceId": {"kind": "youtube#video", "videoId": video_id},
+            }
+        },
+    )
+
+
+def insert_videos(youtube, playlist_id, videos, ordered=True):
+    """Add videos to a playlist.
+
+    videos is a list of (position, video_id) pairs. Returns four lists of
+    positions: those added, those that failed for good (e.g. the video was
+    removed), those to try again shortly and those refused because the
+    quota ran out.
+
+    Videos are added one request at a time, and once one has to wait the
+    rest wait with it, so the playlist keeps the order of the positions.
+    With ordered=False they are sent in a single batched HTTP request,
+    which is faster but Google may run the calls in any order.
+    """
+    from googleapiclient.errors import HttpError
+
+    added = []
+    failed = []
+    retry = []
+    quota_hit = []
+
+    def waiting_list(error):
+        if is_quota_error(error):
+            return quota_hit
+        if is_transient_error(error):
+            return retry
+        if isinstance(error, HttpError):
+            return failed
+        raise error
+
+    if ordered:
+        for index, (position, video_id) in enumerate(videos):
+            try:
+                _insert_request(youtube, playlist_id, video_id).execute()
+            except Exception as exc:
+                waiting = waiting_list(exc)
+                if waiting is failed:
+                    failed.append(position)
+                    continue
+                waiting.extend(p for p, _ in videos[index:])
+                break
+            added.append(position)
+        return added, failed, retry, quota_hit
+
+    def callback(request_id, response, exception):
+        position = int(request_id)
+        if exception is None:
+            added.append(position)
+        else:
+            waiting_list(exception).append(position)
+
+    batch = youtube.new_batch_http_request(callback=callback)
+    for position, video_id in videos:
+        batch.add(
+            _insert_request(youtube, playlist_id, video_id),
+            request_id=str(position),
+        )
+    try:
+        batch.execute()
+    except Exception as exc:
+        # the whole request failed, the calls not answered yet wait
+        waiting = waiting_list(exc)
+        if waiting is failed:
+            raise
+        done = set(added + failed + retry + quota_hit)
+        waiting.extend(p for p, _ in videos if p not in done)
+    return sorted(added), sorted(failed), sorted(retry), sorted(quota_hit)
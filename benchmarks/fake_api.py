@@ -0,0 +1,188 @@
+"""Local stand-in for the Spotify and YouTube APIs.
+
+Playlists are synthetic: the id "B<size>S<seed>R<anything>" is a playlist
+of <size> tracks whose track ids depend only on the number <seed>, so
+separate playlists can share their tracks or not. Every request sleeps
+for latency seconds, and a share of the Spotify ones (rate_429) is
+answered with a 429 and a Retry-After header.
+"""
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+PLAYLIST = re.compile(r"^/v1/playlists/([^/]+)$")
+# newer spotipy releases page through /items instead of /tracks
+PLAYLIST_TRACKS = re.compile(r"^/v1/playlists/([^/]+)/(?:tracks|items)$")
+PLAYLIST_ID = re.compile(r"^B(\d+)S(\d+)R")
+
+
+def playlist_size(playlist_id):
+    match = PLAYLIST_ID.match(playlist_id)
+    return int(match.group(1)) if match else 0
+
+
+def make_track(playlist_id, position):
+    match = PLAYLIST_ID.match(playlist_id)
+    seed = match.group(2) if match else "0"
+    track_id = "{}x{}".format(seed, position).rjust(22, "0")
+    artist = "Artist {}".format(position % 997)
+    return {
+        "added_at": "2020-01-01T00:00:00Z",
+        "is_local": False,
+        "track": {
+            "id": track_id,
+            "uri": "spotify:track:{}".format(track_id),
+            "type": "track",
+            "name": "Song {} {}".format(seed, position),
+            "duration_ms": 120000 + (position * 7919) % 240000,
+            "artists": [{"id": "a{}".format(position % 997), "name": artist}],
+            "album": {"id": "al{}".format(position % 311), "name": "Album"},
+            "is_local": False,
+        },
+    }
+
+
+def trim(item, fields):
+    # only the fields=items(track(id)) form used by incremental scrapes
+    if fields and "track(id)" in fields:
+        return {"track": {"id": item["track"]["id"]}}
+    return item
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        server.count()
+        time.sleep(server.latency)
+        if self.path.startswith("/v1/") and random.random() < server.rate_429:
+            server.count(throttled=True)
+            return self.send_json(
+                429,
+                {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                {"Retry-After": str(server.retry_after)},
+            )
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        match = PLAYLIST.match(url.path)
+        if match:
+            playlist_id = match.group(1)
+            return self.send_json(
+                200,
+                {
+                    "id": playlist_id,
+                    "name": "Benchmark {}".format(playlist_id),
+                    "owner": {"id": "bench"},
+                    "snapshot_id": "snapshot-{}".format(playlist_id),
+                    "tracks": {"total": playlist_size(playlist_id)},
+                },
+            )
+
+        match = PLAYLIST_TRACKS.match(url.path)
+        if match:
+            playlist_id = match.group(1)
+            offset = int(query.get("offset", 0))
+            limit = int(query.get("limit", 100))
+            end = min(offset + limit, playlist_size(playlist_id))
+            items = [
+                trim(make_track(playlist_id, i), query.get("fields"))
+                for i in range(offset, end)
+            ]
+            return self.send_json(
+                200,
+                {
+                    "items": items,
+                    "offset": offset,
+                    "limit": limit,
+                    "total": playlist_size(playlist_id),
+                },
+            )
+
+        if url.path == "/youtube/v3/search":
+            q = query.get("q", "")
+            items = [
+                {
+                    "id": {
+                        "kind": "youtube#video",
+                        "videoId": "v{:010d}".format(
+                            zlib.crc32("{}:{}".format(q, i).encode("utf-8"))
+                        ),
+                    },
+                    "snippet": {"title": q if i == 0 else "{} (live)".format(q)},
+                }
+                for i in range(int(query.get("maxResults", 5)))
+            ]
+            return self.send_json(200, {"items": items})
+
+        if url.path == "/youtube/v3/videos":
+            items = [
+                {"id": video_id, "contentDetails": {"duration": "PT3M30S"}}
+                for video_id in query.get("id", "").split(",")
+                if video_id
+            ]
+            return self.send_json(200, {"items": items})
+
+        self.send_json(404, {"error": {"status": 404, "message": "Not found"}})
+
+
+class FakeAPIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, rate_429=0.0, retry_after=1, port=0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address)
+
+    def count(self, throttled=False):
+        with self._lock:
+            if throttled:
+                self.throttled += 1
+            else:
+                self.requests += 1
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeAPIServer(args.latency, args.rate_429, port=args.port)
+    print("Serving on", server.url)
+    server.serve_forever()
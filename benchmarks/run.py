@@ -0,0 +1,243 @@
+"""Benchmark scraping and the result routes against the fake API server.
+
+Each playlist size runs in its own process, so peak RSS is per size:
+
+    python -m benchmarks.run --sizes 100,1000,10000,50000
+
+Needs Redis at REDIS_URL, like the app. The database is a throwaway
+SQLite file unless --database is given.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(p / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+def summarize(latencies, items=None):
+    # latencies in seconds, items is how much work each run did
+    total = sum(latencies)
+    summary = {
+        "runs": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "per_second": len(latencies) / total if total else None,
+    }
+    if items is not None and total:
+        summary["items_per_second"] = items * len(latencies) / total
+    return summary
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        return peak / 1024.0 / 1024.0
+    return peak / 1024.0
+
+
+def use_fake_api(server, args):
+    """Point the Spotify and YouTube clients at the fake server."""
+    import MySpotify
+    import spotipy
+
+    spotify = spotipy.Spotify(
+        auth="benchmark", retries=0, status_retries=0, requests_timeout=30
+    )
+    spotify.prefix = server.url + "/v1/"
+    MySpotify.get_spotify_client = lambda: spotify
+
+    from app import clients, get_settings
+
+    settings = get_settings()
+    document = dict(clients.get_discovery_document())
+    document["rootUrl"] = server.url + "/"
+    document["baseUrl"] = server.url + "/youtube/v3/"
+    clients._discovery[
+        (settings["YOUTUBE_API_SERVICE_NAME"], settings["YOUTUBE_API_VERSION"])
+    ] = document
+
+
+def run_size(size, args):
+    # runs in the child process, imports the app only once configured
+    from benchmarks.fake_api import FakeAPIServer
+    from config import Config
+
+    Config.SPOTIFY_MAX_RATE = args.spotify_rate
+    Config.SPOTIFY_RATE_BURST = args.spotify_rate
+    Config.SPOTIFY_BACKOFF_MAX = 2
+    Config.YOUTUBE_API_KEY = "benchmark"
+    Config.YOUTUBE_DAILY_QUOTA = 10 ** 9
+    Config.YOUTUBE_SEARCHES_PER_SECOND = 10 ** 6
+
+    server = FakeAPIServer(args.latency, args.rate_429, args.retry_after).start()
+    from app import create_app, db
+    from app.models import Job, User
+    from app.redis_conn import get_redis
+    from app.tasks import celery, match_youtube, scrape_spotify
+
+    app = create_app()
+    use_fake_api(server, args)
+    celery.conf.task_always_eager = True
+    celery.conf.task_eager_propagates = True
+    app.config["WTF_CSRF_ENABLED"] = False
+    get_redis().delete("rate-limit:spotify")
+
+    with app.app_context():
+        db.create_all()
+        name = "bench-{}".format(uuid4().hex[:8])
+        user = User(username=name, email=name + "@example.com")
+        user.set_password("benchmark")
+        db.session.add(user)
+        db.session.commit()
+        user_id, username = user.id, user.username
+    client = app.test_client()
+    client.post("/login", data={"username": username, "password": "benchmark"})
+
+    stages = {}
+    scrape_times = []
+    job_id = None
+    for run in range(args.repeat):
+        # a new playlist each run, so the snapshot shortcut never applies
+        seed = run + 1 if args.cold else 0
+        playlist_id = "B{}S{}R{}".format(size, seed, uuid4().hex[:8])
+        job_id = str(uuid4())
+        with app.app_context():
+            db.session.add(Job(id=job_id, user_id=user_id, playlist_id=playlist_id))
+            db.session.commit()
+        start = time.perf_counter()
+        scrape_spotify.apply(
+            args=["https://open.spotify.com/playlist/" + playlist_id],
+            task_id=job_id,
+        ).get()
+        scrape_times.append(time.perf_counter() - start)
+    stages["scrape"] = summarize(scrape_times, items=size)
+
+    status_times = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        client.get("/task-status/" + job_id)
+        status_times.append(time.perf_counter() - start)
+    stages["task_status"] = summarize(status_times)
+
+    songs_times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        response = client.get("/show_songs?job_id=" + job_id)
+        response.get_data()
+        songs_times.append(time.perf_counter() - start)
+    stages["show_songs"] = summarize(songs_times, items=size)
+
+    page_times = []
+    url = "/api/jobs/{}/songs".format(job_id)
+    while url:
+        start = time.perf_counter()
+        url = client.get(url).get_json()["next"]
+        page_times.append(time.perf_counter() - start)
+    stages["songs_api_page"] = summarize(page_times)
+
+    if args.match:
+        start = time.perf_counter()
+        match_youtube.apply(args=[job_id]).get()
+        stages["match_youtube"] = summarize([time.perf_counter() - start], items=size)
+
+    return {
+        "size": size,
+        "stages": stages,
+        "peak_rss_mb": peak_rss_mb(),
+        "api_requests": server.requests,
+        "api_throttled": server.throttled,
+    }
+
+
+def print_table(results):
+    print(
+        "{:>7} {:<16} {:>5} {:>10} {:>10} {:>10} {:>12} {:>9}".format(
+            "tracks", "stage", "runs", "p50 ms", "p95 ms", "p99 ms", "items/s", "rss MB"
+        )
+    )
+    for result in results:
+        for name, stage in result["stages"].items():
+            rate = stage.get("items_per_second") or stage["per_second"]
+            print(
+                "{:>7} {:<16} {:>5} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.1f} {:>9.1f}".format(
+                    result["size"],
+                    name,
+                    stage["runs"],
+                    stage["p50_ms"],
+                    stage["p95_ms"],
+                    stage["p99_ms"],
+                    rate or 0,
+                    result["peak_rss_mb"],
+                )
+            )
+        print(
+            "{:>7} {} API requests, {} throttled".format(
+                "", result["api_requests"], result["api_throttled"]
+            )
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000,50000")
+    parser.add_argument("--repeat", type=int, default=5, help="scrapes per size")
+    parser.add_argument(
+        "--requests", type=int, default=200, help="task-status requests per size"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="seconds per API request"
+    )
+    parser.add_argument(
+        "--rate-429", type=float, default=0.0, help="share of requests throttled"
+    )
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument(
+        "--spotify-rate",
+        type=float,
+        default=1000,
+        help="SPOTIFY_MAX_RATE for the run, the fake server has no real limit",
+    )
+    parser.add_argument(
+        "--cold", action="store_true", help="give every scrape new track ids"
+    )
+    parser.add_argument("--match", action="store_true", help="also time match_youtube")
+    parser.add_argument("--database", help="DATABASE_URL, a temporary SQLite file by default")
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    # a fresh process per size, started after DATABASE_URL is set
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ["DATABASE_URL"] = args.database or "sqlite:///" + os.path.join(
+                tmp, "benchmark.db"
+            )
+            with context.Pool(1) as pool:
+                results.append(pool.apply(run_size, (size, args)))
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""compact job results
+
+Revision ID: 12f0486cf66f
+Revises: 27bb7a13ede2
+Create Date: 2026-10-18 15:09:28.513573
+
+"""
+import json
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy_utils
+
+
+# revision identifiers, used by Alembic.
+revision = '12f0486cf66f'
+down_revision = '27bb7a13ede2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('job') as batch_op:
+        batch_op.add_column(sa.Column('compact_result', sa.LargeBinary(length=2 ** 32 - 1), nullable=True))
+    copy_results('result', 'compact_result', encode=True)
+    with op.batch_alter_table('job') as batch_op:
+        batch_op.drop_column('result')
+        batch_op.alter_column('compact_result', new_column_name='result')
+
+
+def downgrade():
+    with op.batch_alter_table('job') as batch_op:
+        batch_op.add_column(sa.Column('json_result', sqlalchemy_utils.types.json.JSONType(), nullable=True))
+    copy_results('result', 'json_result', encode=False)
+    with op.batch_alter_table('job') as batch_op:
+        batch_op.drop_column('result')
+        batch_op.alter_column('json_result', new_column_name='result')
+
+
+# The format as it was when this migration was written, copied from
+# app.codec so later changes there don't change what this writes.
+MAGIC = b"SYT1"
+
+
+def pack_tracks(rows):
+    artists = {}
+    packed = {"names": [], "artists": [], "artist_idx": [], "lengths": []}
+    ids = []
+    for row in rows:
+        packed["names"].append(row[0])
+        index = artists.get(row[1])
+        if index is None:
+            index = artists[row[1]] = len(packed["artists"])
+            packed["artists"].append(row[1])
+        packed["artist_idx"].append(index)
+        packed["lengths"].append(row[2])
+        ids.append(row[3] if len(row) > 3 else None)
+    if any(ids):
+        packed["ids"] = ids
+    return packed
+
+
+def unpack_tracks(packed):
+    names = packed["names"]
+    artists = [packed["artists"][i] for i in packed["artist_idx"]]
+    if "ids" in packed:
+        columns = (names, artists, packed["lengths"], packed["ids"])
+    else:
+        columns = (names, artists, packed["lengths"])
+    return [list(row) for row in zip(*columns)]
+
+
+def encode_tracks(rows):
+    text = json.dumps(pack_tracks(rows), separators=(",", ":"))
+    return MAGIC + zlib.compress(text.encode("utf-8"))
+
+
+def load_rows(data):
+    # Postgres returns JSON columns already parsed, whatever the column
+    # is declared as here
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        return unpack_tracks(data)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    data = bytes(data)
+    if data.startswith(MAGIC):
+        return unpack_tracks(json.loads(zlib.decompress(data[len(MAGIC):])))
+    return json.loads(data)
+
+
+def copy_results(source, target, encode):
+    # rewrite each stored result in the other format, one job at a time
+    job = sa.table('job',
+        sa.column('id', sa.String),
+        sa.column(source, sa.LargeBinary if not encode else sa.Text),
+        sa.column(target, sa.LargeBinary if encode else sa.Text),
+    )
+    conn = op.get_bind()
+    ids = conn.execute(
+        sa.select([job.c.id]).where(job.c[source].isnot(None))
+    ).fetchall()
+    for (job_id,) in ids:
+        data = conn.execute(
+            sa.select([job.c[source]]).where(job.c.id == job_id)
+        ).scalar()
+        rows = load_rows(data)
+        if encode:
+            value = encode_tracks(rows)
+        else:
+            value = json.dumps(rows)
+        conn.execute(
+            job.update().where(job.c.id == job_id).values({target: value})
+        )
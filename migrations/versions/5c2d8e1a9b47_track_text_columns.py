@@ -0,0 +1,28 @@
+"""track text columns
+
+Revision ID: 5c2d8e1a9b47
+Revises: 7fa3933c12c7
+Create Date: 2026-10-18 16:02:11.402215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2d8e1a9b47'
+down_revision = '7fa3933c12c7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('track') as batch_op:
+        batch_op.alter_column('name', existing_type=sa.String(length=256), type_=sa.Text(), existing_nullable=True)
+        batch_op.alter_column('artists', existing_type=sa.String(length=512), type_=sa.Text(), existing_nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('track') as batch_op:
+        batch_op.alter_column('artists', existing_type=sa.Text(), type_=sa.String(length=512), existing_nullable=True)
+        batch_op.alter_column('name', existing_type=sa.Text(), type_=sa.String(length=256), existing_nullable=True)
@@ -0,0 +1,43 @@
+"""clear backfilled results
+
+Revision ID: b6e1d2f4a873
+Revises: 927c20f906fa
+Create Date: 2026-10-18 16:30:12.418903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy_utils
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e1d2f4a873'
+down_revision = '927c20f906fa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # normalized_tracks used to leave Job.result filled after copying it
+    # into job_track, only compacted jobs should still have one
+    job = sa.table('job',
+        sa.column('result', sa.LargeBinary),
+        sa.column('track_count', sa.Integer),
+        sa.column('compacted', sa.Boolean),
+    )
+    op.execute(
+        job.update()
+        .where(
+            sa.and_(
+                job.c.result.isnot(None),
+                job.c.track_count.isnot(None),
+                job.c.compacted.isnot(True),
+            )
+        )
+        .values(result=None)
+    )
+
+
+def downgrade():
+    # the songs are still in job_track, nothing to put back
+    pass
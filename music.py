@@ -1,6 +1,9 @@
-from app import app, db
+from app import create_app, db
 from app.models import User, Job
 
+app = create_app()
+
+
 @app.shell_context_processor
 def make_shell_context():
-    return {'db': db, 'User': User, 'Job': Job}
\ No newline at end of file
+    return {'db': db, 'User': User, 'Job': Job}
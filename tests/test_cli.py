@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask_migrate import upgrade
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import Job, User
+from config import TestingConfig
+
+migrations = os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations")
+
+
+def migrated_app(path):
+    class Config(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + path
+
+    app = create_app(Config, web=False)
+    with app.app_context():
+        upgrade(directory=migrations)
+    return app
+
+
+def enforce_foreign_keys(engine):
+    # SQLite ignores foreign keys unless asked on every connection
+    @event.listens_for(engine, "connect")
+    def connect(connection, record):
+        connection.execute("PRAGMA foreign_keys=ON")
+
+    engine.dispose()
+
+
+class CopyDbCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.dir, "source.db")
+        self.source = migrated_app(self.source_path)
+        self.target = migrated_app(os.path.join(self.dir, "target.db"))
+
+    def tearDown(self):
+        for app in self.source, self.target:
+            with app.app_context():
+                db.engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def test_copy_self_referencing_jobs(self):
+        with self.source.app_context():
+            db.session.add(User(id=1, username="susan", job_ref="b"))
+            # joined jobs come before the job they point at
+            db.session.add(Job(id="c", user_id=1, source_id="a"))
+            db.session.add(Job(id="b", user_id=1, source_id="a"))
+            db.session.add(Job(id="a", user_id=1, playlist_id="playlist"))
+            db.session.commit()
+
+        with self.target.app_context():
+            enforce_foreign_keys(db.engine)
+            result = self.target.test_cli_runner().invoke(
+                args=["copy-db", "sqlite:///" + self.source_path, "--batch-size", "2"]
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("job: 3 rows", result.output)
+            jobs = {job.id: job.source_id for job in Job.query}
+            self.assertEqual(jobs, {"a": None, "b": "a", "c": "a"})
+            self.assertEqual(User.query.get(1).job_ref, "b")
+
+    def test_target_not_empty(self):
+        with self.target.app_context():
+            db.session.add(User(id=1, username="susan"))
+            db.session.commit()
+            result = self.target.test_cli_runner().invoke(
+                args=["copy-db", "sqlite:///" + self.source_path]
+            )
+            self.assertNotEqual(result.exit_code, 0)
+            self.assertIn("Table user is not empty", result.output)
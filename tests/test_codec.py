@@ -0,0 +1,63 @@
+import importlib.util
+import json
+import os
+import unittest
+
+from app.codec import (MAGIC, decode_tracks, encode_tracks, pack_tracks,
+                       unpack_tracks)
+
+migration_path = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    "migrations",
+    "versions",
+    "12f0486cf66f_compact_job_results.py",
+)
+
+ROWS = [
+    ["Song 0", "Artist", 180000, "track0"],
+    ["Song 1", "Other Artist", 200000, "track1"],
+    ["Song 2", "Artist", None, None],
+]
+
+
+def load_migration():
+    spec = importlib.util.spec_from_file_location("compact_results", migration_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class CodecCase(unittest.TestCase):
+    def test_pack_round_trip(self):
+        packed = pack_tracks(ROWS)
+        self.assertEqual(packed["artists"], ["Artist", "Other Artist"])
+        self.assertEqual(unpack_tracks(packed), ROWS)
+
+    def test_pack_without_ids(self):
+        rows = [row[:3] for row in ROWS]
+        packed = pack_tracks(rows)
+        self.assertNotIn("ids", packed)
+        self.assertEqual(unpack_tracks(packed), rows)
+
+    def test_encode_round_trip(self):
+        data = encode_tracks(ROWS)
+        self.assertTrue(data.startswith(MAGIC))
+        self.assertEqual(decode_tracks(data), ROWS)
+        self.assertEqual(decode_tracks(memoryview(data)), ROWS)
+        self.assertEqual(decode_tracks([]), [])
+
+    def test_legacy_json(self):
+        text = json.dumps(ROWS)
+        self.assertEqual(decode_tracks(text), ROWS)
+        self.assertEqual(decode_tracks(text.encode("utf-8")), ROWS)
+
+    def test_already_parsed(self):
+        self.assertEqual(decode_tracks(ROWS), ROWS)
+        self.assertEqual(decode_tracks(pack_tracks(ROWS)), ROWS)
+
+    def test_reads_what_the_migration_wrote(self):
+        migration = load_migration()
+        data = migration.encode_tracks(ROWS)
+        self.assertEqual(decode_tracks(data), ROWS)
+        self.assertEqual(migration.load_rows(data), ROWS)
+        self.assertEqual(migration.load_rows(json.dumps(ROWS)), ROWS)
@@ -0,0 +1,78 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from app import matching
+from app.matching import Matcher, QuotaExhausted
+from app.youtube import QUOTA_TIMEZONE, seconds_until_quota_reset
+
+
+class FakeLimiter:
+    def __init__(self):
+        self.exhausted = False
+
+    def wait(self):
+        pass
+
+    def spend(self, units):
+        if self.exhausted:
+            raise QuotaExhausted()
+
+    def exhaust(self):
+        self.exhausted = True
+
+
+class FakeRequest:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+class MatcherCase(unittest.TestCase):
+    def test_quota_error_stops_matching(self):
+        # the counter thinks there is quota left, YouTube disagrees
+        error = HttpError(
+            httplib2.Response({"status": 403}),
+            b'{"error": {"errors": [{"reason": "quotaExceeded"}]}}',
+        )
+        client = mock.Mock()
+        client.search().list.return_value = FakeRequest(error)
+        limiter = FakeLimiter()
+        with mock.patch.object(matching, "youtube_key_client", return_value=client):
+            matches = Matcher(limiter, workers=2).match(
+                [(1, "Song", "Artist", 180), (2, "Other", "Artist", 200)]
+            )
+        self.assertEqual(matches, {})
+        self.assertTrue(limiter.exhausted)
+
+    def test_other_errors_are_raised(self):
+        client = mock.Mock()
+        client.search().list.return_value = FakeRequest(
+            HttpError(httplib2.Response({"status": 400}), b"{}")
+        )
+        with mock.patch.object(matching, "youtube_key_client", return_value=client):
+            with self.assertRaises(HttpError):
+                Matcher(FakeLimiter()).match([(1, "Song", "Artist", 180)])
+
+
+class QuotaDayCase(unittest.TestCase):
+    def reset_at(self, *now):
+        return seconds_until_quota_reset(
+            datetime(*now, tzinfo=QUOTA_TIMEZONE).timestamp()
+        )
+
+    def test_pacific_midnight(self):
+        self.assertEqual(self.reset_at(2026, 6, 1, 23, 0), 3600 + 60)
+        # 8:00 UTC, when the UTC day is well under way
+        self.assertEqual(self.reset_at(2026, 1, 1, 0, 0), 24 * 3600 + 60)
+
+    def test_daylight_saving(self):
+        # the day clocks go back is 25 hours long
+        self.assertEqual(self.reset_at(2026, 11, 1, 0, 0), 25 * 3600 + 60)
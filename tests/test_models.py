@@ -0,0 +1,74 @@
+import unittest
+from unittest import mock
+
+from app import create_app, db, models
+from app.models import Job, Track
+from config import TestingConfig
+
+
+def make_rows(count):
+    return [
+        ["Song {}".format(i), "Artist", 180000, "track{}".format(i)]
+        for i in range(count)
+    ]
+
+
+class JobTracksCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig, web=False)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def save_job(self, rows):
+        job = Job(id="job")
+        db.session.add(job)
+        job.save_tracks(rows)
+        db.session.commit()
+        return job
+
+    def test_repeated_track(self):
+        rows = make_rows(1199)
+        rows.insert(600, rows[3])
+        job = self.save_job(rows)
+        self.assertEqual(job.track_count, 1200)
+        self.assertEqual(job.get_tracks(), rows)
+        self.assertEqual(job.get_tracks(600, 1), [rows[3]])
+        self.assertEqual(list(job.iter_tracks(batch_size=500)), rows)
+
+    def test_repeated_track_in_same_batch(self):
+        rows = make_rows(3)
+        rows.append(rows[0])
+        job = self.save_job(rows)
+        self.assertEqual(job.get_tracks(), rows)
+
+    def test_track_inserted_by_another_job(self):
+        # the other job commits track1 after this one looked it up
+        db.session.add(Track(spotify_id="track1", name="Song 1"))
+        db.session.commit()
+        lookups = []
+
+        def known_tracks(spotify_ids):
+            lookups.append(spotify_ids)
+            if len(lookups) == 1:
+                return {}
+            return known(spotify_ids)
+
+        known = models._known_tracks
+        with mock.patch.object(models, "_known_tracks", known_tracks):
+            job = self.save_job(make_rows(3))
+        self.assertEqual(job.get_tracks()[1][3], "track1")
+        self.assertEqual(Track.query.count(), 3)
+
+    def test_long_names(self):
+        rows = [["x" * 1000, ", ".join(["Artist"] * 200), 1, "track0"]]
+        self.assertEqual(self.save_job(rows).get_tracks(), rows)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
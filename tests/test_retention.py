@@ -0,0 +1,121 @@
+import unittest
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.models import Job, JobTrack, PlaylistTransfer, Track, User
+from app.retention import compact_jobs, delete_jobs, delete_orphan_tracks
+from config import TestingConfig
+
+OLD = datetime.utcnow() - timedelta(days=30)
+CUTOFF = datetime.utcnow() - timedelta(days=7)
+
+
+def make_rows(job_id, count=3):
+    return [
+        ["Song {}".format(i), "Artist", 180000, "{}-track{}".format(job_id, i)]
+        for i in range(count)
+    ]
+
+
+class RetentionCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestingConfig, web=False)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(id=1, username="susan")
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_job(self, job_id, source_id=None, timestamp=OLD):
+        job = Job(id=job_id, user_id=1, timestamp=timestamp, source_id=source_id)
+        db.session.add(job)
+        if source_id is None:
+            job.save_tracks(make_rows(job_id))
+        db.session.commit()
+        return job
+
+    def add_transfer(self, job_id, status):
+        db.session.add(PlaylistTransfer(job_id=job_id, user_id=1, status=status))
+        db.session.commit()
+
+    def compacted(self):
+        return {job.id for job in Job.query.filter_by(compacted=True)}
+
+    def test_compact_old_jobs(self):
+        self.add_job("old")
+        self.add_job("new", timestamp=datetime.utcnow())
+        rows = Job.query.get("old").get_tracks()
+
+        self.assertEqual(compact_jobs(CUTOFF, batch_size=1), 1)
+        self.assertEqual(self.compacted(), {"old"})
+        self.assertEqual(JobTrack.query.filter_by(job_id="old").count(), 0)
+        self.assertEqual(Job.query.get("old").get_tracks(), rows)
+        self.assertEqual(JobTrack.query.filter_by(job_id="new").count(), 3)
+        self.assertEqual(compact_jobs(CUTOFF, batch_size=1), 0)
+
+    def test_compact_keeps_jobs_in_use(self):
+        self.add_job("current")
+        self.add_job("joined")
+        self.add_job("joiner", source_id="joined")
+        self.add_job("transferring")
+        self.add_job("transfer-source")
+        self.add_job("transfer-joiner", source_id="transfer-source")
+        self.add_job("transferred")
+        self.user.job_ref = "joiner"
+        self.add_transfer("transferring", "PAUSED")
+        self.add_transfer("transfer-joiner", "RUNNING")
+        self.add_transfer("transferred", "COMPLETE")
+        db.session.commit()
+        self.add_job("unused")
+        db.session.add(User(id=2, username="john", job_ref="current"))
+        db.session.commit()
+
+        compact_jobs(CUTOFF, batch_size=10)
+        self.assertEqual(self.compacted(), {"transferred", "unused"})
+
+    def test_delete_old_jobs(self):
+        self.add_job("old")
+        self.add_job("new", timestamp=datetime.utcnow())
+
+        self.assertEqual(delete_jobs(CUTOFF, batch_size=1), 1)
+        self.assertEqual({job.id for job in Job.query}, {"new"})
+        self.assertEqual(JobTrack.query.filter_by(job_id="old").count(), 0)
+
+    def test_delete_keeps_jobs_in_use(self):
+        self.add_job("current")
+        self.add_job("joined", timestamp=datetime.utcnow() - timedelta(days=60))
+        self.add_job("joiner", source_id="joined", timestamp=datetime.utcnow())
+        self.add_job("transferred")
+        self.add_transfer("transferred", "COMPLETE")
+        self.add_job("unused")
+        self.user.job_ref = "current"
+        db.session.commit()
+
+        self.assertEqual(delete_jobs(CUTOFF, batch_size=10), 1)
+        self.assertEqual(
+            {job.id for job in Job.query},
+            {"current", "joined", "joiner", "transferred"},
+        )
+
+    def test_delete_orphan_tracks(self):
+        self.add_job("old")
+        self.add_job("kept", timestamp=datetime.utcnow())
+        delete_jobs(CUTOFF, batch_size=10)
+        matched = Track.query.filter_by(spotify_id="old-track0").one()
+        matched.youtube_id = "video"
+        matched.matched_at = datetime.utcnow()
+        unmatched = Track.query.filter_by(spotify_id="old-track1").one()
+        unmatched.matched_at = datetime.utcnow()
+        db.session.commit()
+
+        self.assertEqual(delete_orphan_tracks(batch_size=1), 1)
+        self.assertEqual(
+            {track.spotify_id for track in Track.query},
+            {"old-track0", "old-track1", "kept-track0", "kept-track1", "kept-track2"},
+        )
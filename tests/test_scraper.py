@@ -0,0 +1,35 @@
+import time
+import unittest
+
+from app.scraper import fetch_playlist_pages
+
+SUMMARY = {"id": "playlist", "owner": {"id": "owner"}}
+
+
+class FakeSpotify:
+    # fails the page at fail_offset, records every page asked for
+    def __init__(self, fail_offset=None):
+        self.fail_offset = fail_offset
+        self.offsets = []
+
+    def user_playlist_tracks(self, user, playlist_id, limit, offset, fields):
+        self.offsets.append(offset)
+        if offset == self.fail_offset:
+            raise ValueError("bad page")
+        time.sleep(0.01)
+        return {"offset": offset}
+
+
+class FetchPlaylistPagesCase(unittest.TestCase):
+    def test_pages_in_order(self):
+        spotify = FakeSpotify()
+        pages = fetch_playlist_pages(spotify, SUMMARY, [0, 100, 200], max_workers=3)
+        self.assertEqual([page["offset"] for page in pages], [0, 100, 200])
+
+    def test_error_cancels_queued_pages(self):
+        spotify = FakeSpotify(fail_offset=0)
+        with self.assertRaises(ValueError):
+            fetch_playlist_pages(
+                spotify, SUMMARY, list(range(0, 5000, 100)), max_workers=1
+            )
+        self.assertLess(len(spotify.offsets), 10)
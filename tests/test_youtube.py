@@ -0,0 +1,113 @@
+import unittest
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from app.youtube import insert_videos
+
+
+def http_error(status, reason=""):
+    return HttpError(
+        httplib2.Response({"status": status}),
+        '{{"error": {{"errors": [{{"reason": "{}"}}]}}}}'.format(reason).encode(),
+    )
+
+
+class FakeRequest:
+    def __init__(self, youtube, video_id):
+        self.youtube = youtube
+        self.video_id = video_id
+
+    def execute(self):
+        if self.video_id in self.youtube.errors:
+            raise self.youtube.errors[self.video_id]
+        self.youtube.playlist.append(self.video_id)
+        return {"id": self.video_id}
+
+
+class FakeBatch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        # the order Google runs batched calls in isn't promised
+        for request_id, request in reversed(self.requests):
+            try:
+                response = request.execute()
+            except HttpError as exc:
+                self.callback(request_id, None, exc)
+            else:
+                self.callback(request_id, response, None)
+
+
+class FakeYouTube:
+    # errors maps video ids to the error their insert raises
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.playlist = []
+
+    def playlistItems(self):
+        return self
+
+    def insert(self, part, body):
+        return FakeRequest(self, body["snippet"]["resourceId"]["videoId"])
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(callback)
+
+
+def make_videos(count):
+    return [(position, "v{}".format(position)) for position in range(count)]
+
+
+class InsertVideosCase(unittest.TestCase):
+    def insert(self, youtube, videos, **kwargs):
+        return insert_videos(youtube, "playlist", videos, **kwargs)
+
+    def test_ordered(self):
+        youtube = FakeYouTube()
+        result = self.insert(youtube, make_videos(5))
+        self.assertEqual(result, ([0, 1, 2, 3, 4], [], [], []))
+        self.assertEqual(youtube.playlist, ["v0", "v1", "v2", "v3", "v4"])
+
+    def test_removed_video_is_skipped(self):
+        youtube = FakeYouTube({"v1": http_error(404, "videoNotFound")})
+        result = self.insert(youtube, make_videos(3))
+        self.assertEqual(result, ([0, 2], [1], [], []))
+
+    def test_transient_error_holds_back_the_rest(self):
+        youtube = FakeYouTube({"v2": http_error(409, "SERVICE_UNAVAILABLE")})
+        result = self.insert(youtube, make_videos(5))
+        self.assertEqual(result, ([0, 1], [], [2, 3, 4], []))
+        self.assertEqual(youtube.playlist, ["v0", "v1"])
+
+    def test_backend_error(self):
+        youtube = FakeYouTube({"v0": http_error(503, "backendError")})
+        result = self.insert(youtube, make_videos(2))
+        self.assertEqual(result, ([], [], [0, 1], []))
+
+    def test_quota(self):
+        youtube = FakeYouTube({"v1": http_error(403, "quotaExceeded")})
+        result = self.insert(youtube, make_videos(3))
+        self.assertEqual(result, ([0], [], [], [1, 2]))
+
+    def test_unordered(self):
+        youtube = FakeYouTube(
+            {
+                "v1": http_error(404, "videoNotFound"),
+                "v2": http_error(500, "backendError"),
+                "v3": http_error(403, "quotaExceeded"),
+            }
+        )
+        result = self.insert(youtube, make_videos(5), ordered=False)
+        self.assertEqual(result, ([0, 4], [1], [2], [3]))
+        self.assertEqual(youtube.playlist, ["v4", "v0"])
+
+    def test_unexpected_error_is_raised(self):
+        youtube = FakeYouTube({"v0": ValueError("bug")})
+        with self.assertRaises(ValueError):
+            self.insert(youtube, make_videos(2))
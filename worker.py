@@ -0,0 +1,6 @@
+from app import create_app
+from app.tasks import celery
+
+# celery -A worker worker, see README. Celery looks for an attribute named
+# app before one named celery, so the Flask app must be called otherwise.
+flask_app = create_app(web=False)